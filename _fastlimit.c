@@ -0,0 +1,428 @@
+/*
+ * Compiled fast path for the rate limiters. See `fast_limiters.py`.
+ *
+ * `Table` keeps per-key state in flat C arrays instead of cache entries:
+ * a dict maps each key to a slot, and the slot holds the counter, last time
+ * and expiration (plus the timestamps for sliding window). Decisions use
+ * the same floating point expressions, in the same order, as
+ * `rate_limiters.py`, so they are bit-identical.
+ *
+ * Build: python setup.py build_ext --inplace
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <math.h>
+
+enum {
+	FIXED_WINDOW = 0,
+	ENFORCED_AVG = 1,
+	SLIDING_WINDOW = 2,
+	LEAKY_BUCKET = 3,
+};
+
+#define MAX_SLIDING_LIMIT 65536
+
+typedef struct {
+	double counter;     /* fixed window / leaky bucket counter */
+	double time;        /* leaky bucket: time of the last OK */
+	double expiration;  /* entry is gone once expiration <= now */
+	Py_ssize_t count;   /* sliding window: number of stored timestamps */
+} Slot;
+
+typedef struct {
+	PyObject_HEAD
+	int algorithm;
+	double limit;
+	double window_length_ms;
+	double leak_rate;
+	double exclusion_window;
+	Py_ssize_t times_per_slot;
+	PyObject *index;       /* key -> slot number */
+	Slot *slots;
+	double *times;         /* sliding window: times_per_slot timestamps per slot */
+	Py_ssize_t size;       /* slots handed out */
+	Py_ssize_t capacity;   /* slots allocated */
+	Py_ssize_t *free_slots;
+	Py_ssize_t num_free;
+} Table;
+
+static PyObject *str_status, *str_counter, *str_new, *str_ok, *str_denied;
+
+static int
+table_grow(Table *self)
+{
+	Py_ssize_t capacity = self->capacity ? self->capacity * 2 : 1024;
+	Slot *slots = PyMem_Realloc(self->slots, capacity * sizeof(Slot));
+	if (slots == NULL) {
+		PyErr_NoMemory();
+		return -1;
+	}
+	self->slots = slots;
+
+	if (self->times_per_slot) {
+		double *times = PyMem_Realloc(self->times, capacity * self->times_per_slot * sizeof(double));
+		if (times == NULL) {
+			PyErr_NoMemory();
+			return -1;
+		}
+		self->times = times;
+	}
+
+	Py_ssize_t *free_slots = PyMem_Realloc(self->free_slots, capacity * sizeof(Py_ssize_t));
+	if (free_slots == NULL) {
+		PyErr_NoMemory();
+		return -1;
+	}
+	self->free_slots = free_slots;
+	self->capacity = capacity;
+	return 0;
+}
+
+/* returns the slot for `key`, creating an empty (expired) one if needed; -1 on error */
+static Py_ssize_t
+table_slot(Table *self, PyObject *key)
+{
+	PyObject *found = PyDict_GetItemWithError(self->index, key);
+	if (found != NULL)
+		return PyLong_AsSsize_t(found);
+	if (PyErr_Occurred())
+		return -1;
+
+	Py_ssize_t slot;
+	if (self->num_free) {
+		slot = self->free_slots[--self->num_free];
+	} else {
+		if (self->size == self->capacity && table_grow(self) < 0)
+			return -1;
+		slot = self->size++;
+	}
+
+	PyObject *value = PyLong_FromSsize_t(slot);
+	if (value == NULL)
+		return -1;
+	int err = PyDict_SetItem(self->index, key, value);
+	Py_DECREF(value);
+	if (err < 0)
+		return -1;
+
+	self->slots[slot].expiration = -INFINITY;
+	self->slots[slot].count = 0;
+	return slot;
+}
+
+static PyObject *
+make_result(PyObject *status, PyObject *counter, int new_)
+{
+	/* steals the `counter` reference */
+	PyObject *result = PyDict_New();
+	if (result == NULL) {
+		Py_XDECREF(counter);
+		return NULL;
+	}
+	if (PyDict_SetItem(result, str_status, status) < 0)
+		goto error;
+	if (counter != NULL) {
+		if (PyDict_SetItem(result, str_counter, counter) < 0)
+			goto error;
+		Py_CLEAR(counter);
+	}
+	if (new_ >= 0 && PyDict_SetItem(result, str_new, new_ ? Py_True : Py_False) < 0)
+		goto error;
+	return result;
+
+error:
+	Py_XDECREF(counter);
+	Py_DECREF(result);
+	return NULL;
+}
+
+static int
+table_init(Table *self, PyObject *args, PyObject *kwds)
+{
+	static char *kwlist[] = {"algorithm", "limit", "window_length_ms", "leak_rate", NULL};
+	int algorithm;
+	double limit, window_length_ms, leak_rate = 1.0;
+	Py_ssize_t times_per_slot = 0;
+
+	/* parse and validate into locals, so a failed (re-)initialisation leaves the table as it was */
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "idd|d", kwlist,
+			&algorithm, &limit, &window_length_ms, &leak_rate))
+		return -1;
+
+	if (algorithm < FIXED_WINDOW || algorithm > LEAKY_BUCKET) {
+		PyErr_Format(PyExc_ValueError, "Invalid algorithm: %d", algorithm);
+		return -1;
+	}
+	if (!(limit > 0) || !(window_length_ms > 0) || !(leak_rate > 0)) {
+		PyErr_SetString(PyExc_ValueError, "limit, window_length_ms and leak_rate must be positive");
+		return -1;
+	}
+	if (algorithm == SLIDING_WINDOW) {
+		if (limit > MAX_SLIDING_LIMIT) {
+			PyErr_Format(PyExc_ValueError, "sliding window limit must be at most %d", MAX_SLIDING_LIMIT);
+			return -1;
+		}
+		times_per_slot = (Py_ssize_t)ceil(limit);
+	}
+
+	PyObject *index = PyDict_New();
+	if (index == NULL)
+		return -1;
+
+	/* calling __init__ again starts over: the old buffers are sized for the old parameters */
+	Py_XSETREF(self->index, index);
+	PyMem_Free(self->slots);
+	PyMem_Free(self->times);
+	PyMem_Free(self->free_slots);
+	self->slots = NULL;
+	self->times = NULL;
+	self->free_slots = NULL;
+	self->capacity = 0;
+	self->size = 0;
+	self->num_free = 0;
+
+	self->algorithm = algorithm;
+	self->limit = limit;
+	self->window_length_ms = window_length_ms;
+	self->leak_rate = leak_rate;
+	self->exclusion_window = 1000 / limit;  /* enforced average: `limit` is limit_rps */
+	self->times_per_slot = times_per_slot;
+	return 0;
+}
+
+static void
+table_dealloc(Table *self)
+{
+	Py_XDECREF(self->index);
+	PyMem_Free(self->slots);
+	PyMem_Free(self->times);
+	PyMem_Free(self->free_slots);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+/* Tables made with `Table.__new__` and never initialised have no index yet */
+static int
+table_check_init(Table *self)
+{
+	if (self->index == NULL) {
+		PyErr_SetString(PyExc_RuntimeError, "Table is not initialised");
+		return -1;
+	}
+	return 0;
+}
+
+static PyObject *
+table_allow(Table *self, PyObject *const *args, Py_ssize_t nargs)
+{
+	if (table_check_init(self) < 0)
+		return NULL;
+	if (nargs != 2) {
+		PyErr_SetString(PyExc_TypeError, "allow() takes exactly 2 arguments (key, now)");
+		return NULL;
+	}
+	double now = PyFloat_AsDouble(args[1]);
+	if (now == -1.0 && PyErr_Occurred())
+		return NULL;
+
+	Py_ssize_t slot_num = table_slot(self, args[0]);
+	if (slot_num < 0)
+		return NULL;
+	Slot *slot = &self->slots[slot_num];
+	int exists = slot->expiration > now;
+
+	switch (self->algorithm) {
+
+	case FIXED_WINDOW:
+		if (exists) {
+			if (slot->counter < self->limit) {
+				slot->counter += 1;  /* incr() does not reset ttl */
+				return make_result(str_ok, PyLong_FromDouble(slot->counter), -1);
+			}
+			return make_result(str_denied, PyLong_FromDouble(slot->counter), -1);
+		}
+		slot->counter = 1;
+		slot->expiration = now + self->window_length_ms;
+		return make_result(str_ok, PyLong_FromLong(1), -1);
+
+	case ENFORCED_AVG:
+		if (exists)
+			return make_result(str_denied, NULL, -1);
+		slot->expiration = now + self->exclusion_window;
+		return make_result(str_ok, NULL, -1);
+
+	case SLIDING_WINDOW: {
+		double *times = self->times + slot_num * self->times_per_slot;
+		if (exists) {
+			/* remove all times that are outside the window; DENIED leaves the stored times untouched */
+			Py_ssize_t kept = 0;
+			for (Py_ssize_t i = 0; i < slot->count; i++)
+				kept += now - times[i] < self->window_length_ms;
+
+			if (kept < self->limit) {
+				Py_ssize_t j = 0;
+				for (Py_ssize_t i = 0; i < slot->count; i++)
+					if (now - times[i] < self->window_length_ms)
+						times[j++] = times[i];
+				times[j++] = now;
+				slot->count = j;
+				slot->expiration = now + self->window_length_ms;
+				return make_result(str_ok, PyLong_FromSsize_t(j), 0);
+			}
+			return make_result(str_denied, PyLong_FromSsize_t(kept), 0);
+		}
+		times[0] = now;
+		slot->count = 1;
+		slot->expiration = now + self->window_length_ms;
+		return make_result(str_ok, PyLong_FromLong(1), 1);
+	}
+
+	case LEAKY_BUCKET:
+		if (exists) {
+			double counter = slot->counter - ((now - slot->time) * self->leak_rate) / self->window_length_ms;
+			if (!(counter > 0))
+				counter = 0;  /* max(counter, 0) */
+
+			if (counter + 1 < self->limit) {
+				slot->counter = counter + 1;
+				slot->time = now;
+				slot->expiration = now + (counter + 1) * self->window_length_ms / self->leak_rate;
+				return make_result(str_ok, PyFloat_FromDouble(counter + 1), 0);
+			}
+			return make_result(str_denied, PyFloat_FromDouble(counter), 0);
+		}
+		slot->counter = 1;
+		slot->time = now;
+		slot->expiration = now + self->window_length_ms / self->leak_rate;
+		return make_result(str_ok, PyLong_FromLong(1), 1);
+	}
+
+	Py_UNREACHABLE();
+}
+
+static PyObject *
+table_purge(Table *self, PyObject *arg)
+{
+	if (table_check_init(self) < 0)
+		return NULL;
+	double now = PyFloat_AsDouble(arg);
+	if (now == -1.0 && PyErr_Occurred())
+		return NULL;
+
+	PyObject *expired = PyList_New(0);
+	if (expired == NULL)
+		return NULL;
+
+	PyObject *key, *value;
+	Py_ssize_t pos = 0;
+	while (PyDict_Next(self->index, &pos, &key, &value)) {
+		if (self->slots[PyLong_AsSsize_t(value)].expiration <= now && PyList_Append(expired, key) < 0)
+			goto error;
+	}
+
+	Py_ssize_t n = PyList_GET_SIZE(expired);
+	for (Py_ssize_t i = 0; i < n; i++) {
+		key = PyList_GET_ITEM(expired, i);
+		value = PyDict_GetItemWithError(self->index, key);
+		if (value == NULL)
+			goto error;
+		self->free_slots[self->num_free++] = PyLong_AsSsize_t(value);
+		if (PyDict_DelItem(self->index, key) < 0)
+			goto error;
+	}
+
+	Py_DECREF(expired);
+	return PyLong_FromSsize_t(n);
+
+error:
+	Py_DECREF(expired);
+	return NULL;
+}
+
+static PyObject *
+table_reset(Table *self, PyObject *Py_UNUSED(ignored))
+{
+	if (self->index != NULL)
+		PyDict_Clear(self->index);
+	self->size = 0;
+	self->num_free = 0;
+	Py_RETURN_NONE;
+}
+
+static PyObject *
+table_nbytes(Table *self, PyObject *Py_UNUSED(ignored))
+{
+	Py_ssize_t nbytes = self->capacity * (sizeof(Slot) + sizeof(Py_ssize_t) + self->times_per_slot * sizeof(double));
+	return PyLong_FromSsize_t(nbytes);
+}
+
+static Py_ssize_t
+table_len(Table *self)
+{
+	return self->index != NULL ? PyDict_GET_SIZE(self->index) : 0;
+}
+
+static PyMethodDef table_methods[] = {
+	{"allow", (PyCFunction)(void (*)(void))table_allow, METH_FASTCALL,
+	 "allow(key, now) -> dict\n\nRate limits one request for `key` at time `now` (ms)."},
+	{"purge", (PyCFunction)table_purge, METH_O,
+	 "purge(now) -> int\n\nFrees the slots of keys that have expired by `now`; returns how many."},
+	{"reset", (PyCFunction)table_reset, METH_NOARGS, "Forgets every key."},
+	{"nbytes", (PyCFunction)table_nbytes, METH_NOARGS, "Bytes allocated for the state arrays."},
+	{NULL, NULL, 0, NULL},
+};
+
+static PySequenceMethods table_as_sequence = {
+	.sq_length = (lenfunc)table_len,
+};
+
+static PyTypeObject TableType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	.tp_name = "_fastlimit.Table",
+	.tp_doc = "Table(algorithm, limit, window_length_ms, leak_rate=1.0)\n\nPer-key limiter state in flat C arrays.",
+	.tp_basicsize = sizeof(Table),
+	.tp_flags = Py_TPFLAGS_DEFAULT,
+	.tp_new = PyType_GenericNew,
+	.tp_init = (initproc)table_init,
+	.tp_dealloc = (destructor)table_dealloc,
+	.tp_methods = table_methods,
+	.tp_as_sequence = &table_as_sequence,
+};
+
+static struct PyModuleDef fastlimit_module = {
+	PyModuleDef_HEAD_INIT,
+	.m_name = "_fastlimit",
+	.m_doc = "Compiled fast path for the rate limiters. Use it through fast_limiters.py.",
+	.m_size = -1,
+};
+
+PyMODINIT_FUNC
+PyInit__fastlimit(void)
+{
+	if (PyType_Ready(&TableType) < 0)
+		return NULL;
+
+	str_status = PyUnicode_InternFromString("status");
+	str_counter = PyUnicode_InternFromString("counter");
+	str_new = PyUnicode_InternFromString("new");
+	str_ok = PyUnicode_InternFromString("OK");
+	str_denied = PyUnicode_InternFromString("DENIED");
+	if (!str_status || !str_counter || !str_new || !str_ok || !str_denied)
+		return NULL;
+
+	PyObject *module = PyModule_Create(&fastlimit_module);
+	if (module == NULL)
+		return NULL;
+
+	Py_INCREF(&TableType);
+	if (PyModule_AddObject(module, "Table", (PyObject *)&TableType) < 0
+		|| PyModule_AddIntConstant(module, "FIXED_WINDOW", FIXED_WINDOW) < 0
+		|| PyModule_AddIntConstant(module, "ENFORCED_AVG", ENFORCED_AVG) < 0
+		|| PyModule_AddIntConstant(module, "SLIDING_WINDOW", SLIDING_WINDOW) < 0
+		|| PyModule_AddIntConstant(module, "LEAKY_BUCKET", LEAKY_BUCKET) < 0) {
+		Py_DECREF(&TableType);
+		Py_DECREF(module);
+		return NULL;
+	}
+	return module;
+}
@@ -0,0 +1,257 @@
+'''Adaptive limits: tighten admission automatically when the upstream slows down.
+
+The limiters take a static `limit`. `AdaptiveLimiter` passes a limit that a controller moves based on the latency and errors of completed requests:
+
+- `AIMDController`: additive increase while latency is under target, multiplicative decrease when it isn't (like TCP congestion control)
+- `GradientController`: scales the limit by the ratio of baseline latency to current latency, so it backs off in proportion to how much queueing there is
+
+```python
+limiter = AdaptiveLimiter(leaky_bucket, {'window_length_ms': 1000, 'mode': 'soft', 'clock': clock}, AIMDController(initial_limit=100, latency_target_ms=50))
+
+def request_handler(request_ip: str):
+  if limiter(request_ip)['status'] == 'OK':
+    start = clock.now()
+    ...  # call upstream
+    limiter.record(clock.now() - start, error=failed)
+```
+
+Run `python adaptive.py` for a `DummyTime` simulation of an upstream that slows down mid-run, comparing tail latency with a static limit.
+'''
+
+import math
+import heapq
+from typing import Callable
+
+from clocks import Clock, MonotonicClock
+
+class AIMDController:
+	''' Additive increase, multiplicative decrease.
+	'''
+
+	def __init__(self, initial_limit: float, latency_target_ms: float, min_limit: float = 1, max_limit: float = math.inf, increase: float = 1.0, decrease: float = 0.7, cooldown_ms: float = None):
+		''' `initial_limit`: Starting limit.
+
+		`latency_target_ms`: Completed requests slower than this count as congestion.
+
+		`min_limit`, `max_limit`: Bounds for the limit.
+
+		`increase`: Limit added per `limit` successful completions, i.e. about once per round of requests.
+
+		`decrease`: Factor applied to the limit on congestion or error.
+
+		`cooldown_ms`: At most one decrease per cooldown, so one slow batch doesn't collapse the limit. Defaults to `latency_target_ms`.
+		'''
+		if not 0 < decrease < 1:
+			raise ValueError(f'Invalid decrease: {decrease}')
+
+		self.limit = initial_limit
+		self.latency_target_ms = latency_target_ms
+		self.min_limit = min_limit
+		self.max_limit = max_limit
+		self.increase = increase
+		self.decrease = decrease
+		self.cooldown_ms = cooldown_ms if cooldown_ms is not None else latency_target_ms
+		self._last_decrease = -math.inf
+
+	def update(self, latency_ms: float, error: bool, now: float) -> float:
+		''' Feeds one completed request.
+
+		returns: The new limit.
+		'''
+		if error or latency_ms > self.latency_target_ms:
+			if now - self._last_decrease >= self.cooldown_ms:
+				self.limit = max(self.limit * self.decrease, self.min_limit)
+				self._last_decrease = now
+		else:
+			self.limit = min(self.limit + self.increase / self.limit, self.max_limit)
+		return self.limit
+
+class GradientController:
+	''' Gradient-based control. Once per interval, compares the interval's average latency with a slow baseline; the limit shrinks by their ratio when latency rises and grows by `sqrt(limit)` of headroom when it doesn't.
+	'''
+
+	def __init__(self, initial_limit: float, min_limit: float = 1, max_limit: float = math.inf, interval_ms: float = 50, smoothing: float = 0.3, tolerance: float = 1.5, baseline_alpha: float = 0.05, baseline_creep: float = 0.01, error_penalty: float = 0.9):
+		''' `initial_limit`: Starting limit.
+
+		`min_limit`, `max_limit`: Bounds for the limit.
+
+		`interval_ms`: How often the limit is updated.
+
+		`smoothing`: How far the limit moves toward its new target per update (0-1).
+
+		`tolerance`: Latency may exceed the baseline by this factor before the limit shrinks.
+
+		`baseline_alpha`: How fast the baseline follows latency while it's within tolerance.
+
+		`baseline_creep`: Relative growth of the baseline per congested interval, so a slower upstream eventually becomes the new normal.
+
+		`error_penalty`: Factor applied to the limit on an error.
+		'''
+		self.limit = initial_limit
+		self.min_limit = min_limit
+		self.max_limit = max_limit
+		self.interval_ms = interval_ms
+		self.smoothing = smoothing
+		self.tolerance = tolerance
+		self.baseline_alpha = baseline_alpha
+		self.baseline_creep = baseline_creep
+		self.error_penalty = error_penalty
+		self.baseline = None
+		self._interval_start = None
+		self._total_ms = 0.0
+		self._count = 0
+
+	def update(self, latency_ms: float, error: bool, now: float) -> float:
+		''' Feeds one completed request.
+
+		returns: The new limit.
+		'''
+		if error:
+			self.limit = max(self.limit * self.error_penalty, self.min_limit)
+			return self.limit
+
+		self._total_ms += latency_ms
+		self._count += 1
+		if self._interval_start is None:
+			self._interval_start = now
+		if now - self._interval_start < self.interval_ms:
+			return self.limit
+
+		latency = self._total_ms / self._count
+		self._interval_start = now
+		self._total_ms = 0.0
+		self._count = 0
+
+		if self.baseline is None:
+			self.baseline = latency
+		if latency <= self.tolerance * self.baseline:
+			self.baseline += self.baseline_alpha * (latency - self.baseline)
+		else:
+			self.baseline *= 1 + self.baseline_creep
+
+		gradient = min(max(self.tolerance * self.baseline / latency, 0.5), 1.0)
+		target = self.limit * gradient + math.sqrt(self.limit)  # sqrt(limit) of headroom to probe for more
+		self.limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+		self.limit = min(max(self.limit, self.min_limit), self.max_limit)
+		return self.limit
+
+class AdaptiveLimiter:
+	''' Calls a rate limiter with the controller's current limit.
+	'''
+
+	def __init__(self, rate_limiter: Callable, limiter_args: dict, controller, clock: Clock = None):
+		''' `rate_limiter`: A function from `rate_limiters.py`.
+
+		`limiter_args`: Its other keyword arguments, without `key` and the limit.
+
+		`controller`: `AIMDController` or `GradientController`.
+
+		`clock`: Timestamps completions that `record()` gets without `now`. Defaults to the limiter's `clock` argument, then its cache's clock, then `MonotonicClock`.
+		'''
+		if clock is None:
+			clock = limiter_args.get('clock')
+		if clock is None:
+			clock = getattr(limiter_args.get('cache'), 'clock', None)
+		self.rate_limiter = rate_limiter
+		self.limiter_args = limiter_args
+		self.controller = controller
+		self.clock = clock if clock is not None else MonotonicClock()
+		self.limit_arg = 'limit_rps' if rate_limiter.__name__ == 'enforced_avg' else 'limit'
+
+	@property
+	def limit(self) -> float:
+		return self.controller.limit
+
+	def __call__(self, key: str) -> dict:
+		return self.rate_limiter(key, **{self.limit_arg: self.controller.limit}, **self.limiter_args)
+
+	def record(self, latency_ms: float, error: bool = False, now: float = None):
+		''' Feeds the latency of a completed upstream call back into the controller.
+
+		`now`: Completion time in milliseconds; used for the AIMD cooldown and the gradient interval. Defaults to `clock.now()`.
+		'''
+		self.controller.update(latency_ms, error, now if now is not None else self.clock.now())
+
+class Upstream:
+	''' Simulated upstream: `servers` parallel workers with a FIFO queue. Service time is `service_ms`, multiplied by `slowdown` between `slow_from_ms` and `slow_until_ms`.
+	'''
+
+	def __init__(self, servers: int, service_ms: float, slowdown: float = 1.0, slow_from_ms: float = math.inf, slow_until_ms: float = math.inf):
+		self.free_at = [0.0] * servers
+		self.service_ms = service_ms
+		self.slowdown = slowdown
+		self.slow_from_ms = slow_from_ms
+		self.slow_until_ms = slow_until_ms
+
+	def submit(self, now: float) -> float:
+		''' returns: The latency of a request arriving at `now`.
+		'''
+		start = max(now, self.free_at[0])
+		service_ms = self.service_ms * (self.slowdown if self.slow_from_ms <= start < self.slow_until_ms else 1.0)
+		heapq.heapreplace(self.free_at, start + service_ms)
+		return start + service_ms - now
+
+def simulate(limiter: Callable, record: Callable, dummy_time, upstream: Upstream) -> dict:
+	''' Runs `dummy_time`'s requests through `limiter` and sends the admitted ones to `upstream`. Completions are fed to `record` once they finish, in time order.
+
+	returns: Admitted / denied counts and latency percentiles of the admitted requests.
+	'''
+	completions = []  # (finish time, latency)
+	latencies = []
+	denied = 0
+
+	for now in dummy_time:
+		while completions and completions[0][0] <= now:
+			finish, latency = heapq.heappop(completions)
+			record(latency, False, finish)
+
+		if limiter('global')['status'] == 'OK':
+			latency = upstream.submit(now)
+			latencies.append(latency)
+			heapq.heappush(completions, (now + latency, latency))
+		else:
+			denied += 1
+
+	latencies.sort()
+	def percentile(p):
+		return latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+
+	return {
+		'admitted': len(latencies),
+		'denied': denied,
+		'p50_ms': percentile(50),
+		'p99_ms': percentile(99),
+		'max_ms': latencies[-1] if latencies else 0.0,
+	}
+
+if __name__ == "__main__":
+	import random
+	from dummy_time import DummyTime
+	from dummy_cache import DummyCache
+	from rate_limiters import leaky_bucket
+
+	RPS = 300
+	DURATION = 30.0
+	LIMIT = 350  # sized for the healthy upstream: 4 servers x 10 ms = 400 rps
+
+	random.seed(0)  # same arrivals every run, so the numbers in the README reproduce
+	dummy_time = DummyTime(RPS, DURATION, mode='random')
+	cache = DummyCache(clock=dummy_time)
+	limiter_args = {'window_length_ms': 1000, 'mode': 'soft', 'clock': dummy_time, 'cache': cache}
+
+	def upstream():  # 4x slower (100 rps) from 10 s to 20 s
+		return Upstream(servers=4, service_ms=10, slowdown=4, slow_from_ms=10_000, slow_until_ms=20_000)
+
+	aimd = AdaptiveLimiter(leaky_bucket, limiter_args, AIMDController(LIMIT, latency_target_ms=30, min_limit=10, max_limit=LIMIT, increase=20, decrease=0.8))
+	gradient = AdaptiveLimiter(leaky_bucket, limiter_args, GradientController(LIMIT, min_limit=10, max_limit=LIMIT))
+
+	print(f'{RPS} rps random arrivals for {DURATION:.0f} s; upstream capacity drops from 400 to 100 rps between 10 s and 20 s')
+	for name, limiter, record in [
+		('static limit', lambda key: leaky_bucket(key, LIMIT, **limiter_args), lambda *_: None),
+		('AIMD', aimd, aimd.record),
+		('gradient', gradient, gradient.record),
+	]:
+		cache.reset()
+		dummy_time.reset()
+		result = simulate(limiter, record, dummy_time, upstream())
+		print(f'{name:>13}: {result["admitted"]:>5} admitted, {result["denied"]:>5} denied, p50 {result["p50_ms"]:7.1f} ms, p99 {result["p99_ms"]:7.1f} ms, max {result["max_ms"]:7.1f} ms')
@@ -0,0 +1,170 @@
+'''Analytic model of the rate limiters, for sizing limits and stores without running simulations.
+
+For one key under steady load, `predict()` gives:
+
+- `admitted_rps`: long-run admitted throughput for requests arriving evenly at `offered_rps`
+- `max_burst`: most requests admitted at a single instant, starting from no state
+- `max_per_window`: worst case, over any arrival pattern, of requests admitted in a `window_length_ms`-long span (e.g. fixed window's cross-window overshoot, or the README's `2 × limit − 1` for soft leaky bucket; both are `2 × limit − 1` for a whole `limit`)
+- `state_values` / `state_bytes`: what one key's cache entry holds at most, and roughly how many bytes that is as Python objects in `DummyCache`
+- `state_ttl_ms`: longest a key's entry outlives its last request
+
+`store_bytes()` turns that into a store size for a given rate of distinct keys. Run `python capacity_model.py` to compare the model against the simulated limiters.
+'''
+
+import math
+import sys
+from dataclasses import dataclass
+
+@dataclass
+class Prediction:
+	admitted_rps: float
+	max_burst: int
+	max_per_window: int
+	state_values: int
+	state_bytes: int
+	state_ttl_ms: float
+
+_FLOAT_BYTES = sys.getsizeof(1.0)
+_INT_BYTES = sys.getsizeof(1)
+_ENTRY_BYTES = sys.getsizeof({"value": None, "expiration": 0.0}) + _FLOAT_BYTES  # `DummyCache` wrapper dict and expiration
+
+def _admitted_rps(per_cycle: int, cycle_ms: float, offered_rps: float) -> float:
+	''' Admitted throughput when `per_cycle` requests are allowed every `cycle_ms`, given evenly spaced arrivals. A cycle can only restart on an arrival, so it's rounded up to a whole number of arrival intervals.
+	'''
+	if offered_rps <= 0:
+		return 0.0
+	interval_ms = 1000 / offered_rps
+	arrivals = math.ceil(cycle_ms / interval_ms - 1e-9)  # arrivals per cycle
+	if arrivals <= per_cycle:  # under the limit; everything gets through
+		return offered_rps
+	return per_cycle * 1000 / (arrivals * interval_ms)
+
+def predict(algorithm: str, limit: float, window_length_ms: float = 1000, mode: str = 'soft', offered_rps: float = math.inf) -> Prediction:
+	''' Predicts steady-state behaviour for one key.
+
+	`algorithm`: `'fixed_window'`, `'enforced_avg'`, `'sliding_window'` or `'leaky_bucket'`.
+
+	`limit`: The limiter's `limit` (`limit_rps` for `enforced_avg`).
+
+	`window_length_ms`: The limiter's window. Ignored by `enforced_avg`, whose window is always 1000 ms.
+
+	`mode`: `'soft'` or `'hard'`, for `leaky_bucket`.
+
+	`offered_rps`: Evenly spaced incoming requests per second. Defaults to unbounded load.
+	'''
+	if algorithm == 'fixed_window':
+		per_window = math.ceil(limit)  # `counter < limit` admits up to ceil(limit)
+		return Prediction(
+			admitted_rps = _admitted_rps(per_window, window_length_ms, offered_rps) if offered_rps != math.inf else per_window * 1000 / window_length_ms,
+			max_burst = per_window,
+			max_per_window = 2 * per_window - 1,  # a window's last per_window - 1 + the next window's per_window; a span that holds a window's first request ends before the next window starts
+			state_values = 1,
+			state_bytes = _ENTRY_BYTES + _INT_BYTES,
+			state_ttl_ms = window_length_ms,
+		)
+
+	if algorithm == 'enforced_avg':
+		exclusion_window = 1000 / limit
+		return Prediction(
+			admitted_rps = _admitted_rps(1, exclusion_window, offered_rps) if offered_rps != math.inf else limit,
+			max_burst = 1,
+			max_per_window = math.ceil(limit),  # within any 1000 ms
+			state_values = 1,
+			state_bytes = _ENTRY_BYTES + _INT_BYTES,
+			state_ttl_ms = exclusion_window,
+		)
+
+	if algorithm == 'sliding_window':
+		per_window = math.ceil(limit)  # `len(times) < limit` admits up to ceil(limit)
+		return Prediction(
+			admitted_rps = _admitted_rps(per_window, window_length_ms, offered_rps) if offered_rps != math.inf else per_window * 1000 / window_length_ms,
+			max_burst = per_window,
+			max_per_window = per_window,
+			state_values = per_window,
+			state_bytes = _ENTRY_BYTES + sys.getsizeof([0.0] * per_window) + per_window * _FLOAT_BYTES,
+			state_ttl_ms = window_length_ms,
+		)
+
+	if algorithm == 'leaky_bucket':
+		if mode == 'soft':
+			leak_rate = limit
+		elif mode == 'hard':
+			leak_rate = 1
+		else:
+			raise ValueError(f'Invalid mode: {mode}')
+
+		# the counter never reaches `limit`, so a full bucket is ceil(limit) - 1 requests; it drains at `leak_rate` per window.
+		# After leaking, though, an OK can store a counter just under `limit`, so the TTL can be nearly `limit` drains.
+		bucket = math.ceil(limit) - 1
+		drain_ms = window_length_ms / leak_rate  # per request
+		return Prediction(
+			admitted_rps = min(offered_rps, leak_rate * 1000 / window_length_ms),  # the counter keeps fractional leaks, so nothing is lost to rounding
+			max_burst = max(bucket, 1),
+			max_per_window = max(bucket, 1) + math.floor(leak_rate),  # full bucket + what leaks during the window (2 × limit − 1 when soft)
+			state_values = 2,
+			state_bytes = _ENTRY_BYTES + sys.getsizeof({'counter': 0.0, 'time': 0.0}) + 2 * _FLOAT_BYTES,
+			state_ttl_ms = limit * drain_ms,
+		)
+
+	raise ValueError(f'Invalid algorithm: {algorithm}')
+
+def store_bytes(prediction: Prediction, new_keys_per_s: float) -> float:
+	''' Expected store size when `new_keys_per_s` distinct keys show up per second, each making a short burst of requests.
+
+	Each key's entry lives about `state_ttl_ms` after its last request (Little's law), so the store holds about `new_keys_per_s * state_ttl_ms / 1000` entries.
+	'''
+	return new_keys_per_s * prediction.state_ttl_ms / 1000 * prediction.state_bytes
+
+def _simulate(algorithm: str, limit: float, window_length_ms: float, mode: str, offered_rps: float, duration_s: float = 20.0) -> tuple[float, int, float]:
+	''' returns: Simulated `(admitted_rps, max_per_window, state_ttl_ms)` for evenly spaced requests: throughput over the second half of `duration_s`, and the most requests in any window and longest TTL left on the key's entry over the whole run.
+	'''
+	import rate_limiters
+	from clocks import ManualClock
+	from dummy_cache import DummyCache
+
+	clock = ManualClock()
+	cache = DummyCache(clock=clock)
+	function = getattr(rate_limiters, algorithm)
+	kwargs = {'limit_rps': limit} if algorithm == 'enforced_avg' else {'limit': limit, 'window_length_ms': window_length_ms}
+	if algorithm == 'leaky_bucket':
+		kwargs['mode'] = mode
+	if algorithm in ('sliding_window', 'leaky_bucket'):
+		kwargs['clock'] = clock
+
+	interval_ms = 1000 / offered_rps
+	oks = []
+	state_ttl_ms = 0.0
+	for i in range(int(duration_s * offered_rps)):
+		clock.set((i + 1) * interval_ms)
+		if function('key', cache=cache, **kwargs)['status'] == 'OK':
+			oks.append(clock.now())
+		state_ttl_ms = max(state_ttl_ms, cache.data['key']['expiration'] - clock.now())
+
+	half = duration_s * 1000 / 2
+	admitted_rps = sum(t > half for t in oks) / (duration_s / 2)
+	span = 1000 if algorithm == 'enforced_avg' else window_length_ms
+	max_per_window, lo = 0, 0
+	for hi, t in enumerate(oks):  # most OKs in any half-open span of `span` ms, compared like the limiters do
+		while t - oks[lo] >= span:
+			lo += 1
+		max_per_window = max(max_per_window, hi - lo + 1)
+	return admitted_rps, max_per_window, state_ttl_ms
+
+if __name__ == "__main__":
+	LIMIT = 5
+	WINDOW_LENGTH_MS = 1000
+
+	print(f'limit {LIMIT} / {WINDOW_LENGTH_MS} ms; model vs simulation')
+	for algorithm, mode in [('fixed_window', ''), ('enforced_avg', ''), ('sliding_window', ''), ('leaky_bucket', 'soft'), ('leaky_bucket', 'hard')]:
+		sim_ttl_ms = 0.0
+		for offered_rps in [3, 10, 33, 100]:
+			prediction = predict(algorithm, LIMIT, WINDOW_LENGTH_MS, mode or 'soft', offered_rps)
+			admitted_rps, max_per_window, state_ttl_ms = _simulate(algorithm, LIMIT, WINDOW_LENGTH_MS, mode or 'soft', offered_rps)
+			sim_ttl_ms = max(sim_ttl_ms, state_ttl_ms)
+			print(
+				f'{algorithm + " " + mode:>18} @ {offered_rps:>3} rps:'
+				f'  admitted {prediction.admitted_rps:6.2f} (sim {admitted_rps:6.2f}) rps'
+				f'  max/window <= {prediction.max_per_window:>2} (sim {max_per_window:>2})'
+			)
+		prediction = predict(algorithm, LIMIT, WINDOW_LENGTH_MS, mode or 'soft')
+		print(f'{"":>18}   burst {prediction.max_burst}, {prediction.state_values} values ~{prediction.state_bytes} B / key, TTL {prediction.state_ttl_ms:.0f} ms (sim {sim_ttl_ms:.0f}), 10k new keys/s -> {store_bytes(prediction, 10_000) / 1e6:.1f} MB')
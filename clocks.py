@@ -0,0 +1,93 @@
+'''Clocks for the rate limiters. Every clock returns a timestamp in **milliseconds**.
+
+The rate limiters only need `now()`, so any object with that method works. `DummyTime` (see `dummy_time.py`) is the simulated clock used for the experiments.
+'''
+
+import time
+import threading
+from abc import ABC, abstractmethod
+
+class Clock(ABC):
+	''' Template class for a millisecond clock.
+	'''
+
+	@abstractmethod
+	def now(self) -> float:
+		''' returns: The current time in milliseconds.
+		'''
+
+class MonotonicClock(Clock):
+	''' Real monotonic clock. Not affected by system clock changes (NTP, DST, ...), so it's safe for measuring windows.
+	'''
+
+	def now(self) -> float:
+		return time.monotonic_ns() / 1_000_000
+
+class CachedClock(Clock):
+	''' Coarse clock that only reads its `source` once per tick. `now()` is then just an attribute read, so it's the cheapest clock to call on a hot path.
+
+	Resolution is `tick_ms`, so keep it well below the smallest window you rate limit with.
+	'''
+
+	def __init__(self, tick_ms: float = 1.0, source: Clock = None, start: bool = True):
+		''' Creates a new cached clock.
+
+		`tick_ms`: How often the cached time is refreshed, in milliseconds.
+
+		`source`: The clock to cache. Defaults to `MonotonicClock`.
+
+		`start`: Start the background ticker thread. If `False`, call `tick()` yourself (e.g. from an event loop).
+		'''
+		self.tick_ms = tick_ms
+		self.source = source if source is not None else MonotonicClock()
+		self._now = self.source.now()
+		self._stop = threading.Event()
+		self._thread = None
+
+		if start:
+			self.start()
+
+	def now(self) -> float:
+		return self._now
+
+	def tick(self):
+		''' Refreshes the cached time from the source clock.
+		'''
+		self._now = self.source.now()
+
+	def start(self):
+		''' Starts the background ticker thread.
+		'''
+		if self._thread is not None:
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, name='CachedClock', daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		''' Stops the background ticker thread.
+		'''
+		if self._thread is None:
+			return
+		self._stop.set()
+		self._thread.join()
+		self._thread = None
+
+	def _run(self):
+		while not self._stop.wait(self.tick_ms / 1000):
+			self.tick()
+
+class ManualClock(Clock):
+	''' Clock that only moves when it's told to. Useful when the timestamp arrives with the request, e.g. stamped by a client.
+	'''
+
+	def __init__(self, time_ms: float = 0.0):
+		self.time_ms = time_ms
+
+	def now(self) -> float:
+		return self.time_ms
+
+	def set(self, time_ms: float):
+		''' Sets the current time in milliseconds.
+		'''
+		self.time_ms = time_ms
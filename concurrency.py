@@ -0,0 +1,513 @@
+'''Concurrency limiters: cap the number of requests **in flight** per key, rather than the request rate.
+
+A rate limit doesn't help when each request gets slower: the same rate means more requests piling up at once. These limiters hand out at most `limit` slots per key; each request acquires one before calling upstream and releases it when done.
+
+- `ConcurrencyLimiter`: in-process, thread-safe
+- `SharedConcurrencyLimiter`: shared memory for forked workers. Every slot is a lease that expires after `lease_ms`, so a worker that crashes mid-request can't leak its slots.
+- `AsyncConcurrencyLimiter`: for asyncio. Requests over the limit can wait in a bounded FIFO queue instead of being denied straight away.
+
+```python
+limiter = ConcurrencyLimiter(limit=10)
+
+with limiter.slot(request_ip) as result:
+	if result['status'] == 'OK':
+		...  # call upstream
+```
+
+Run `python concurrency.py` for a benchmark and demos of lease expiry and queueing.
+'''
+
+import math
+import struct
+import zlib
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+from clocks import Clock, MonotonicClock
+
+def _check_limit(limit: int):
+	if not (isinstance(limit, int) and limit > 0):
+		raise ValueError(f'Invalid limit: {limit}')
+
+class ConcurrencyLimiter:
+	''' In-process concurrency limiter. One lock, one counter per key.
+	'''
+
+	def __init__(self, limit: int):
+		''' `limit`: Maximum requests in flight per key.
+		'''
+		_check_limit(limit)
+		self.limit = limit
+		self.in_flight = {}  # key -> requests in flight; keys are dropped at 0
+		self._lock = threading.Lock()
+
+	def acquire(self, key: str) -> dict:
+		''' Takes a slot for `key` if one is free.
+
+		returns: `{"status": "OK" or "DENIED", "in_flight": ...}`. Call `release()` once for every `"OK"`.
+		'''
+		with self._lock:
+			in_flight = self.in_flight.get(key, 0)
+			if in_flight < self.limit:
+				self.in_flight[key] = in_flight + 1
+				return {"status": "OK", "in_flight": in_flight + 1}
+			return {"status": "DENIED", "in_flight": in_flight}
+
+	def release(self, key: str):
+		''' Gives back a slot taken by `acquire()`.
+		'''
+		with self._lock:
+			in_flight = self.in_flight.get(key, 0)
+			if in_flight <= 0:
+				raise ValueError(f'release() without acquire() for key: {key}')
+			if in_flight == 1:
+				del self.in_flight[key]
+			else:
+				self.in_flight[key] = in_flight - 1
+
+	@contextmanager
+	def slot(self, key: str):
+		''' Acquires on entry and, if that succeeded, releases on exit.
+
+		yields: The `acquire()` result.
+		'''
+		result = self.acquire(key)
+		try:
+			yield result
+		finally:
+			if result['status'] == 'OK':
+				self.release(key)
+
+	def __len__(self):
+		''' Number of keys with requests in flight.
+		'''
+		return len(self.in_flight)
+
+# slot header: state, key length, padding, home (probe start within the stripe), key; then `limit` leases of (expiration, generation)
+_HEADER = struct.Struct('<BBxxI64s')
+_HOME = struct.Struct('<I')  # at offset 4
+_LEASE = struct.Struct('<dQ')
+_COUNTER = struct.Struct('<Q')
+MAX_KEY_BYTES = 64
+
+_EMPTY = 0
+_USED = 1
+
+class SharedConcurrencyLimiter:
+	''' Concurrency limiter shared by forked processes, with expiring leases.
+
+	A striped open-addressing table in `multiprocessing.shared_memory`, laid out like `SharedMemoryCache`. Each slot holds a key and `limit` leases. A lease is free once its expiration has passed, and a key's slot is deleted once all its leases are free, with backward-shift deletion as in `SharedMemoryCache`.
+
+	Leases carry a generation number, unique within the key's stripe. `release()` and `renew()` with a stale lease (one that expired and was handed out again) do nothing, so a slow worker can't free somebody else's slot.
+	'''
+
+	def __init__(self, limit: int, lease_ms: float, capacity: int = 16384, stripes: int = 64, clock: Clock = None):
+		''' Creates the shared table. Create it in the parent process **before** forking workers.
+
+		`limit`: Maximum requests in flight per key.
+
+		`lease_ms`: How long a slot is held without `release()` or `renew()`. Set it above your slowest legitimate request.
+
+		`capacity`: Number of key slots. Rounded up to a multiple of `stripes`.
+
+		`stripes`: Number of independently locked stripes.
+
+		`clock`: Must be the same across processes; `MonotonicClock` (the default) is system-wide.
+		'''
+		import multiprocessing as mp  # imported here so the in-process limiters don't pay for it
+		from multiprocessing import shared_memory
+
+		_check_limit(limit)
+		if not lease_ms > 0:
+			raise ValueError(f'Invalid lease_ms: {lease_ms}')
+
+		self.limit = limit
+		self.lease_ms = lease_ms
+		self.stripes = stripes
+		self.stripe_size = max(1, -(-capacity // stripes))
+		self.capacity = self.stripe_size * stripes
+		self.slot_size = _HEADER.size + limit * _LEASE.size
+		self._all_leases = struct.Struct('<' + 'dQ' * limit)
+		self.clock = clock if clock is not None else MonotonicClock()
+		self._counters = self.capacity * self.slot_size  # one generation counter per stripe after the slots
+		self._shm = shared_memory.SharedMemory(create=True, size=self._counters + stripes * _COUNTER.size)
+		self._buf = self._shm.buf
+		self._locks = [mp.Lock() for _ in range(stripes)]
+
+	def _leases(self, slot: int) -> list[tuple[float, int]]:
+		values = self._all_leases.unpack_from(self._buf, slot * self.slot_size + _HEADER.size)
+		return list(zip(values[::2], values[1::2]))
+
+	def _live(self, slot: int, now: float) -> int:
+		return sum(expiration > now for expiration, _ in self._leases(slot))
+
+	def _any_live(self, slot: int, now: float) -> bool:
+		return max(self._all_leases.unpack_from(self._buf, slot * self.slot_size + _HEADER.size)[::2]) > now
+
+	def _find(self, key_bytes: bytes, h: int, now: float) -> tuple[int, int]:
+		''' Probes the stripe of `key_bytes`, deleting slots without live leases on the way. Caller holds the stripe lock.
+
+		returns: `(slot, free)`: the slot holding the key or -1, and the empty slot ending its probe run or -1.
+		'''
+		base = h % self.stripes * self.stripe_size
+		home = (h // self.stripes) % self.stripe_size
+		deleted = False
+		i = 0
+
+		while i < self.stripe_size:
+			slot = base + (home + i) % self.stripe_size
+			state, key_len, _, stored_key = _HEADER.unpack_from(self._buf, slot * self.slot_size)
+
+			if state == _EMPTY:  # end of the probe run
+				return -1, (self._first_empty(base, home) if deleted else slot)
+
+			if not self._any_live(slot, now):
+				self._delete(base, slot - base)
+				deleted = True
+				continue  # a later slot may have moved into this one
+
+			if key_len == len(key_bytes) and stored_key[:key_len] == key_bytes:
+				return slot, -1
+			i += 1
+
+		return -1, self._first_empty(base, home)
+
+	def _first_empty(self, base: int, home: int) -> int:
+		''' returns: The first empty slot from `home` on, or -1. Deleting can wrap around the stripe and empty a slot the probe already passed.
+		'''
+		for i in range(self.stripe_size):
+			slot = base + (home + i) % self.stripe_size
+			if self._buf[slot * self.slot_size] == _EMPTY:
+				return slot
+		return -1
+
+	def _delete(self, base: int, hole: int):
+		''' Empties the slot at `hole` within the stripe starting at `base`, moving back every later slot of its probe run that may go there.
+		'''
+		buf = self._buf
+		size = self.stripe_size
+		slot_size = self.slot_size
+		j = hole
+		for _ in range(size - 1):
+			j = (j + 1) % size
+			offset = (base + j) * slot_size
+			if buf[offset] == _EMPTY:
+				break
+			home = _HOME.unpack_from(buf, offset + 4)[0]
+			if (j - home) % size >= (j - hole) % size:  # `hole` lies between the slot's home and its position
+				hole_offset = (base + hole) * slot_size
+				buf[hole_offset:hole_offset + slot_size] = buf[offset:offset + slot_size]
+				hole = j
+		hole_offset = (base + hole) * slot_size
+		buf[hole_offset:hole_offset + slot_size] = bytes(slot_size)  # the leases too, so a new key starts with none
+
+	def _key(self, key: str) -> tuple[bytes, int]:
+		key_bytes = key.encode()
+		if len(key_bytes) > MAX_KEY_BYTES:
+			raise ValueError(f'Key too long for shared memory slot ({len(key_bytes)} > {MAX_KEY_BYTES} bytes): {key}')
+		return key_bytes, zlib.crc32(key_bytes)
+
+	def acquire(self, key: str) -> dict:
+		''' Takes a lease for `key` if one is free.
+
+		returns: `{"status": "OK" or "DENIED", "in_flight": ..., "lease": ...}`. Pass `lease` to `release()` (and to `renew()` for requests longer than `lease_ms`). `lease` is `None` when denied.
+		'''
+		key_bytes, h = self._key(key)
+
+		stripe = h % self.stripes
+		with self._locks[stripe]:
+			now = self.clock.now()
+			slot, free = self._find(key_bytes, h, now)
+			if slot == -1:
+				if free == -1:
+					raise MemoryError(f'SharedConcurrencyLimiter stripe is full ({self.stripe_size} slots); increase capacity')
+				slot = free
+				_HEADER.pack_into(self._buf, slot * self.slot_size, _USED, len(key_bytes), (h // self.stripes) % self.stripe_size, key_bytes)  # empty slots hold no leases
+
+			leases = self._leases(slot)
+			in_flight = sum(expiration > now for expiration, _ in leases)
+			for i, (expiration, _) in enumerate(leases):
+				if expiration <= now:
+					counter = self._counters + stripe * _COUNTER.size
+					generation = _COUNTER.unpack_from(self._buf, counter)[0] + 1
+					_COUNTER.pack_into(self._buf, counter, generation)
+					_LEASE.pack_into(self._buf, slot * self.slot_size + _HEADER.size + i * _LEASE.size, now + self.lease_ms, generation)
+					return {"status": "OK", "in_flight": in_flight + 1, "lease": (i, generation)}
+			return {"status": "DENIED", "in_flight": in_flight, "lease": None}
+
+	def _update(self, key: str, lease: tuple[int, int], expiration: float) -> bool:
+		''' Sets the expiration of `lease` if it's still the current, live holder of its slot.
+		'''
+		key_bytes, h = self._key(key)
+		index, generation = lease
+
+		with self._locks[h % self.stripes]:
+			now = self.clock.now()
+			slot, _ = self._find(key_bytes, h, now)
+			if slot == -1:
+				return False
+			offset = slot * self.slot_size + _HEADER.size + index * _LEASE.size
+			current_expiration, current_generation = _LEASE.unpack_from(self._buf, offset)
+			if current_generation != generation or current_expiration <= now:
+				return False
+			_LEASE.pack_into(self._buf, offset, expiration, generation)
+			return True
+
+	def release(self, key: str, lease: tuple[int, int]) -> bool:
+		''' Gives back a lease.
+
+		returns: `False` if the lease had already expired.
+		'''
+		return self._update(key, lease, -math.inf)
+
+	def renew(self, key: str, lease: tuple[int, int]) -> bool:
+		''' Extends a lease to `lease_ms` from now.
+
+		returns: `False` if the lease had already expired; the slot may belong to another request by now.
+		'''
+		return self._update(key, lease, self.clock.now() + self.lease_ms)
+
+	@contextmanager
+	def slot(self, key: str):
+		''' Acquires on entry and, if that succeeded, releases on exit.
+
+		yields: The `acquire()` result.
+		'''
+		result = self.acquire(key)
+		try:
+			yield result
+		finally:
+			if result['status'] == 'OK':
+				self.release(key, result['lease'])
+
+	def in_flight(self, key: str) -> int:
+		''' returns: Live leases for `key`.
+		'''
+		key_bytes, h = self._key(key)
+		with self._locks[h % self.stripes]:
+			now = self.clock.now()
+			slot, _ = self._find(key_bytes, h, now)
+			return 0 if slot == -1 else self._live(slot, now)
+
+	def reset(self):
+		''' Drops every lease.
+		'''
+		for lock in self._locks:
+			lock.acquire()
+		try:
+			self._buf[:] = bytes(len(self._buf))
+		finally:
+			for lock in self._locks:
+				lock.release()
+
+	def close(self):
+		''' Detaches this process from the shared memory.
+		'''
+		self._buf.release()
+		self._shm.close()
+
+	def unlink(self):
+		''' Frees the shared memory. Call once, from the process that created the limiter.
+		'''
+		self._shm.unlink()
+
+class AsyncConcurrencyLimiter:
+	''' Concurrency limiter for a single asyncio event loop, with an optional bounded wait queue per key.
+
+	A released slot is handed straight to the longest-waiting request for that key, so waiters are served in FIFO order and can't be overtaken by new arrivals.
+	'''
+
+	def __init__(self, limit: int, max_waiting: int = 0):
+		''' `limit`: Maximum requests in flight per key.
+
+		`max_waiting`: Maximum requests per key waiting for a slot. Requests beyond that are denied immediately. `0` never waits.
+		'''
+		_check_limit(limit)
+		if not (isinstance(max_waiting, int) and max_waiting >= 0):
+			raise ValueError(f'Invalid max_waiting: {max_waiting}')
+
+		self.limit = limit
+		self.max_waiting = max_waiting
+		self.in_flight = {}  # key -> requests in flight
+		self.waiting = {}  # key -> deque of futures
+
+	async def acquire(self, key: str, timeout: float = None) -> dict:
+		''' Takes a slot for `key`, waiting in line for one if the queue has room.
+
+		`timeout`: Longest wait in seconds. `None` waits until a slot frees up.
+
+		returns: `{"status": "OK" or "DENIED", "in_flight": ..., "queued": ...}`. `queued` is whether the request had to wait. Call `release()` once for every `"OK"`.
+		'''
+		in_flight = self.in_flight.get(key, 0)
+		if in_flight < self.limit:
+			self.in_flight[key] = in_flight + 1
+			return {"status": "OK", "in_flight": in_flight + 1, "queued": False}
+
+		queue = self.waiting.setdefault(key, deque())
+		if len(queue) >= self.max_waiting:
+			if not queue:
+				del self.waiting[key]
+			return {"status": "DENIED", "in_flight": in_flight, "queued": False}
+
+		import asyncio  # only needed once requests wait
+
+		future = asyncio.get_running_loop().create_future()
+		queue.append(future)
+		try:
+			await asyncio.wait_for(asyncio.shield(future), timeout)
+		except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+			if future.done() and not future.cancelled():  # handed a slot just as we gave up; pass it on
+				self.release(key)
+			else:
+				future.cancel()
+				self._discard(key, future)
+			if isinstance(error, asyncio.CancelledError):
+				raise
+			return {"status": "DENIED", "in_flight": self.in_flight.get(key, 0), "queued": True}
+		return {"status": "OK", "in_flight": self.in_flight[key], "queued": True}
+
+	def _discard(self, key: str, future):
+		queue = self.waiting.get(key)
+		if queue is not None:
+			try:
+				queue.remove(future)
+			except ValueError:
+				pass
+			if not queue:
+				del self.waiting[key]
+
+	def release(self, key: str):
+		''' Gives back a slot, handing it to the next waiter if there is one.
+		'''
+		in_flight = self.in_flight.get(key, 0)
+		if in_flight <= 0:
+			raise ValueError(f'release() without acquire() for key: {key}')
+
+		queue = self.waiting.get(key)
+		while queue:
+			future = queue.popleft()
+			if not future.done():
+				future.set_result(None)  # the slot changes hands; in_flight stays the same
+				if not queue:
+					del self.waiting[key]
+				return
+		if queue is not None:
+			del self.waiting[key]
+
+		if in_flight == 1:
+			del self.in_flight[key]
+		else:
+			self.in_flight[key] = in_flight - 1
+
+	@asynccontextmanager
+	async def slot(self, key: str, timeout: float = None):
+		''' Acquires on entry and, if that succeeded, releases on exit.
+
+		yields: The `acquire()` result.
+		'''
+		result = await self.acquire(key, timeout)
+		try:
+			yield result
+		finally:
+			if result['status'] == 'OK':
+				self.release(key)
+
+def benchmark(num_requests: int = 200_000):
+	''' Prints ns per acquire + release pair for each implementation.
+	'''
+	import time
+	import asyncio
+
+	limiter = ConcurrencyLimiter(10)
+	start = time.perf_counter_ns()
+	for _ in range(num_requests):
+		limiter.acquire('global')
+		limiter.release('global')
+	print(f'{"in-process":>12}: {(time.perf_counter_ns() - start) / num_requests:6.0f} ns / acquire + release')
+
+	shared = SharedConcurrencyLimiter(10, lease_ms=1000, capacity=1024)
+	try:
+		start = time.perf_counter_ns()
+		for _ in range(num_requests // 10):
+			shared.release('global', shared.acquire('global')['lease'])
+		print(f'{"shared":>12}: {(time.perf_counter_ns() - start) / (num_requests // 10):6.0f} ns / acquire + release')
+	finally:
+		shared.close()
+		shared.unlink()
+
+	async def run_async():
+		limiter = AsyncConcurrencyLimiter(10)
+		start = time.perf_counter_ns()
+		for _ in range(num_requests):
+			await limiter.acquire('global')
+			limiter.release('global')
+		return (time.perf_counter_ns() - start) / num_requests
+	print(f'{"async":>12}: {asyncio.run(run_async()):6.0f} ns / acquire + release')
+
+if __name__ == "__main__":
+	import os
+	import time
+	import asyncio
+	import multiprocessing as mp
+
+	benchmark()
+
+	# churn: 1k new keys every 100 ms, leases never released, so ~10k live at a time; expired slots are reclaimed as probes pass them
+	from clocks import ManualClock
+
+	clock = ManualClock(1.0)
+	shared = SharedConcurrencyLimiter(10, lease_ms=1000, capacity=16384, clock=clock)
+
+	def churn(step: int) -> float:
+		clock.set(1.0 + step * 100.0)
+		start = time.perf_counter()
+		for i in range(step * 1000, (step + 1) * 1000):
+			shared.acquire(f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}')
+		return (time.perf_counter() - start) / 1000 * 1e6
+
+	fresh_us = churn(0)
+	for step in range(1, 100):
+		churned_us = churn(step)
+	print(f'{"churn":>12}: {fresh_us:.1f} us / acquire on a fresh table, {churned_us:.1f} us after 100k distinct keys')
+	shared.close()
+	shared.unlink()
+
+	# a worker dies holding its slots; they come back once the leases expire
+	LIMIT = 4
+	LEASE_MS = 200
+	shared = SharedConcurrencyLimiter(LIMIT, lease_ms=LEASE_MS, capacity=1024)
+
+	def crash():
+		for _ in range(LIMIT):
+			shared.acquire('global')
+		os._exit(1)  # no release
+
+	proc = mp.get_context('fork').Process(target=crash)
+	proc.start()
+	proc.join()
+	print(f'\nworker crashed holding {shared.in_flight("global")} / {LIMIT} slots; new request: {shared.acquire("global")["status"]}')
+	time.sleep(LEASE_MS / 1000)
+	print(f'after {LEASE_MS} ms lease expiry: {shared.in_flight("global")} in flight; new request: {shared.acquire("global")["status"]}')
+	shared.close()
+	shared.unlink()
+
+	# 20 simultaneous 50 ms requests against limit 4, with and without a wait queue
+	async def burst(max_waiting: int):
+		limiter = AsyncConcurrencyLimiter(LIMIT, max_waiting=max_waiting)
+
+		async def request():
+			async with limiter.slot('global') as result:
+				if result['status'] == 'OK':
+					await asyncio.sleep(0.05)
+				return result
+
+		start = time.perf_counter()
+		results = await asyncio.gather(*(request() for _ in range(20)))
+		oks = sum(result['status'] == 'OK' for result in results)
+		queued = sum(result['queued'] and result['status'] == 'OK' for result in results)
+		print(f'max_waiting {max_waiting:>2}: {oks:>2} / 20 OK ({queued} after queueing) in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+	print()
+	for max_waiting in [0, 8, 16]:
+		asyncio.run(burst(max_waiting))
@@ -0,0 +1,276 @@
+'''Differential correctness and performance harness.
+
+Drives every rate limiter implementation with the same traces and compares each decision against the reference functions in `rate_limiters.py` (with `DummyCache`):
+
+- `policies.py` classes
+- `fast_limiters.py`, compiled (if built) and pure-Python tables
+- `SharedMemoryCache` (`fixed_window`, `enforced_avg`, `leaky_bucket`)
+- `LimiterService`, batched across worker processes
+- `shaping.py` with `max_queue=0` (`enforced_avg`, `leaky_bucket`), which must decide exactly like the unshaped limiter. Only `status` and `counter` are compared, since shaped results carry `at` / `wait_ms` instead of `new`
+- `SketchFixedWindow`, which is approximate. It's checked against its documented bounds instead: never more than `limit` per key per aligned window, and no denial unless the true count plus the sketch error bound reaches `limit`.
+
+Traces come from `DummyTime` (uniform, random, cross_window) plus adversarial ones: same-millisecond bursts, requests landing exactly on window boundaries and TTL expiries, and many keys.
+
+Run `python differential.py` for the report; it exits non-zero on any mismatch.
+'''
+
+import sys
+import time
+import random
+from dataclasses import dataclass
+from typing import Callable
+
+from clocks import ManualClock
+from dummy_time import DummyTime
+
+LIMIT = 5
+WINDOW_LENGTH_MS = 1000
+
+@dataclass
+class Trace:
+	name: str
+	times: list[float]
+	keys: list[str]
+
+@dataclass
+class Row:
+	trace: str
+	algorithm: str
+	implementation: str
+	requests: int
+	mismatches: int
+	decisions_per_s: float
+
+def make_traces(seed: int = 0) -> list[Trace]:
+	''' returns: The randomized and adversarial traces, all with non-decreasing times.
+	'''
+	random.seed(seed)
+	traces = []
+
+	for mode in ['uniform', 'random', 'cross_window']:
+		dummy_time = DummyTime(10, 3.0, mode=mode)
+		traces.append(Trace(f'dummy_time {mode}', list(dummy_time.times), ['global'] * len(dummy_time.times)))
+
+	# everything in the same millisecond, then again right at the window / TTL edges
+	times = [0.0] * 20 + [float(WINDOW_LENGTH_MS)] * 20 + [WINDOW_LENGTH_MS / LIMIT * i for i in range(50)]
+	traces.append(Trace('bursts on boundaries', sorted(times), ['global'] * len(times)))
+
+	# exact multiples of the window and of the per-request leak time, for off-by-one TTL checks
+	times = sorted([WINDOW_LENGTH_MS * i for i in range(10)] * 7 + [WINDOW_LENGTH_MS / LIMIT * i for i in range(60)])
+	traces.append(Trace('exact expiries', times, ['global'] * len(times)))
+
+	# many keys, a few of them heavy, at random times
+	num = 20_000
+	keys = [f'bot-{random.randrange(5)}' if random.random() < 0.3 else f'10.0.{random.randrange(40)}.{random.randrange(256)}' for _ in range(num)]
+	traces.append(Trace('many keys', sorted(random.uniform(0, 5000) for _ in range(num)), keys))
+
+	return traces
+
+ALGORITHMS = {
+	'fixed_window': {'limit': LIMIT, 'window_length_ms': WINDOW_LENGTH_MS},
+	'enforced_avg': {'limit_rps': LIMIT},
+	'sliding_window': {'limit': LIMIT, 'window_length_ms': WINDOW_LENGTH_MS},
+	'leaky_bucket soft': {'limit': LIMIT, 'window_length_ms': WINDOW_LENGTH_MS, 'mode': 'soft'},
+	'leaky_bucket hard': {'limit': LIMIT, 'window_length_ms': WINDOW_LENGTH_MS, 'mode': 'hard'},
+}
+
+SHAPED = 'shaped (no queue)'
+SHAPED_FIELDS = ('status', 'counter')  # shaped results carry `at` / `wait_ms` instead of `new`, so they're compared on these only
+
+def _function_name(algorithm: str) -> str:
+	return algorithm.split()[0]
+
+def _sequential(make: Callable) -> Callable:
+	''' Adapts a `make(clock) -> decide(key)` factory into a runner over a whole trace.
+	'''
+	def run(trace: Trace) -> tuple[list[dict], float]:
+		clock = ManualClock()
+		decide = make(clock)
+		results = []
+		start = time.perf_counter()
+		for time_ms, key in zip(trace.times, trace.keys):
+			clock.set(time_ms)
+			results.append(decide(key))
+		return results, time.perf_counter() - start
+	return run
+
+def implementations(algorithm: str) -> dict[str, Callable]:
+	''' returns: Runner per implementation name. Each runner takes a `Trace` and returns the results in order, and the seconds spent deciding (setup excluded). The first one is the reference.
+	'''
+	import rate_limiters
+	import policies
+	import fast_limiters
+	from dummy_cache import DummyCache
+
+	args = ALGORITHMS[algorithm]
+	function = getattr(rate_limiters, _function_name(algorithm))
+	policy_class, fast_class = {
+		'fixed_window': (policies.FixedWindow, fast_limiters.FastFixedWindow),
+		'enforced_avg': (policies.EnforcedAvg, fast_limiters.FastEnforcedAvg),
+		'sliding_window': (policies.SlidingWindow, fast_limiters.FastSlidingWindow),
+		'leaky_bucket': (policies.LeakyBucket, fast_limiters.FastLeakyBucket),
+	}[_function_name(algorithm)]
+	uses_clock = _function_name(algorithm) in ('sliding_window', 'leaky_bucket')
+
+	def reference(clock):
+		cache = DummyCache(clock=clock)
+		kwargs = dict(args, cache=cache, **({'clock': clock} if uses_clock else {}))
+		return lambda key: function(key, **kwargs)
+
+	runners = {
+		'reference': _sequential(reference),
+		'policy': _sequential(lambda clock: policy_class(**args, clock=clock).allow),
+		'fast (python)': _sequential(lambda clock: fast_class(**args, clock=clock, compiled=False).allow),
+	}
+	if fast_limiters.HAVE_COMPILED:
+		runners['fast (C)'] = _sequential(lambda clock: fast_class(**args, clock=clock, compiled=True).allow)
+
+	if _function_name(algorithm) != 'sliding_window':
+		runners['shared memory'] = _run_shared_memory(function, args, uses_clock)
+		runners['service (2 workers)'] = _run_service(function, args)
+
+	if _function_name(algorithm) in ('enforced_avg', 'leaky_bucket'):
+		import shaping
+		shape = getattr(shaping, 'shape_' + _function_name(algorithm))
+
+		def shaped(clock):
+			kwargs = dict(args, max_queue=0, clock=clock, cache=DummyCache(clock=clock))
+			def decide(key):
+				result = shape(key, **kwargs)
+				del result['at'], result['wait_ms']
+				return result
+			return decide
+
+		runners[SHAPED] = _sequential(shaped)
+
+	return runners
+
+def _run_shared_memory(function: Callable, args: dict, uses_clock: bool) -> Callable:
+	def run(trace: Trace) -> tuple[list[dict], float]:
+		from shared_memory_cache import SharedMemoryCache
+
+		clock = ManualClock()
+		cache = SharedMemoryCache(capacity=4 * len(set(trace.keys)) + 64, stripes=16, clock=clock)
+		kwargs = dict(args, **({'clock': clock} if uses_clock else {}))
+		try:
+			results = []
+			start = time.perf_counter()
+			for time_ms, key in zip(trace.times, trace.keys):
+				clock.set(time_ms)
+				results.append(cache.limit(function, key, **kwargs))
+			return results, time.perf_counter() - start
+		finally:
+			cache.close()
+			cache.unlink()
+	return run
+
+def _run_service(function: Callable, args: dict, batch_size: int = 1000) -> Callable:
+	def run(trace: Trace) -> tuple[list[dict], float]:
+		from limiter_service import LimiterService
+
+		with LimiterService(function, args, workers=2) as service:
+			results = []
+			start = time.perf_counter()
+			for i in range(0, len(trace.keys), batch_size):
+				results += service.check(trace.keys[i:i + batch_size], trace.times[i:i + batch_size])
+			return results, time.perf_counter() - start
+	return run
+
+def _normalize(result: dict) -> tuple:
+	''' Compares counters bit for bit but ignores int vs float (`1` vs `1.0`).
+	'''
+	return tuple((k, float(v).hex() if k == 'counter' else v) for k, v in sorted(result.items()))
+
+def check_sketch(trace: Trace) -> tuple[int, float]:
+	''' Runs `SketchFixedWindow` and checks its documented bounds.
+
+	returns: `(violations, decisions_per_s)`.
+	'''
+	from collections import defaultdict
+	from sketch_limiter import SketchFixedWindow
+
+	clock = ManualClock()
+	limiter = SketchFixedWindow(LIMIT, WINDOW_LENGTH_MS, clock=clock)
+	true_counts = defaultdict(int)  # (window, key) -> requests so far
+	admitted = defaultdict(int)
+	violations = 0
+
+	start = time.perf_counter()
+	results = []
+	for time_ms, key in zip(trace.times, trace.keys):
+		clock.set(time_ms)
+		results.append((limiter.allow(key)['status'], limiter.sketch.error_bound()))
+	elapsed = time.perf_counter() - start
+
+	for (status, error_bound), time_ms, key in zip(results, trace.times, trace.keys):
+		window = (time_ms // WINDOW_LENGTH_MS, key)
+		true_counts[window] += 1
+		if status == 'OK':
+			admitted[window] += 1
+			violations += admitted[window] > LIMIT
+		else:
+			violations += true_counts[window] + error_bound < LIMIT  # denied with room to spare
+
+	return violations, len(trace.keys) / elapsed if elapsed else float('inf')
+
+def run(traces: list[Trace] = None) -> list[Row]:
+	''' Runs every implementation on every trace.
+
+	returns: One row per trace, algorithm and implementation.
+	'''
+	traces = traces or make_traces()
+	rows = []
+
+	for trace in traces:
+		for algorithm in ALGORITHMS:
+			expected = None
+			for name, runner in implementations(algorithm).items():
+				got, elapsed = runner(trace)
+
+				if expected is None:
+					expected = got
+				if name == SHAPED:
+					reference = [{k: a[k] for k in SHAPED_FIELDS if k in a} for a in expected]
+				else:
+					reference = expected
+				mismatches = sum(_normalize(a) != _normalize(b) for a, b in zip(reference, got)) + abs(len(reference) - len(got))
+				rows.append(Row(trace.name, algorithm, name, len(trace.keys), mismatches, len(trace.keys) / elapsed if elapsed else float('inf')))
+
+		violations, rate = check_sketch(trace)
+		rows.append(Row(trace.name, 'fixed_window (aligned)', 'sketch (bounds)', len(trace.keys), violations, rate))
+
+	return rows
+
+def report(rows: list[Row]) -> str:
+	''' returns: Plain-text table of correctness and throughput, grouped by trace and algorithm.
+	'''
+	implementations = list(dict.fromkeys(row.implementation for row in rows))
+	width = max(len(name) for name in implementations) + 2
+	lines = []
+
+	for trace in dict.fromkeys(row.trace for row in rows):
+		lines.append(f'\n{trace}  ({next(row.requests for row in rows if row.trace == trace):,} requests)')
+		lines.append(f'{"":>24}' + ''.join(f'{name:>{width}}' for name in implementations))
+
+		for algorithm in dict.fromkeys(row.algorithm for row in rows if row.trace == trace):
+			cells = {row.implementation: row for row in rows if row.trace == trace and row.algorithm == algorithm}
+			line = f'{algorithm:>24}'
+			for name in implementations:
+				row = cells.get(name)
+				if row is None:
+					cell = '-'
+				elif row.mismatches:
+					cell = f'{row.mismatches} BAD'
+				else:
+					cell = f'{row.decisions_per_s / 1000:,.0f}k/s'
+				line += f'{cell:>{width}}'
+			lines.append(line)
+
+	return '\n'.join(lines)
+
+if __name__ == "__main__":
+	rows = run()
+	print(report(rows))
+	bad = sum(row.mismatches for row in rows)
+	print(f'\n{"all implementations agree" if not bad else f"{bad} mismatches / bound violations"}')
+	sys.exit(1 if bad else 0)
@@ -1,15 +1,31 @@
 from typing import Any
-import experiment_globals
+
+_default_clock = None  # the experiments' `dummy_time`, resolved on first use
 
 class DummyCache:
 	''' A class that mimics a remote cache data store.
     '''
 
-	def __init__(self):
+	def __init__(self, clock = None):
 		''' Creates a new instance of the `RemoteCache` class.
+        
+        `clock`: The clock used for TTLs. Defaults to `experiment_globals.dummy_time`.
         '''
+		self.clock = clock
 		self.data = {}
 
+	def now(self) -> float:
+		''' returns: The current time in milliseconds on the clock used for TTLs.
+        '''
+		clock = self.clock
+		if clock is None:
+			global _default_clock
+			if _default_clock is None:
+				import experiment_globals  # imported here; experiment_globals imports this module
+				_default_clock = experiment_globals.dummy_time
+			clock = _default_clock
+		return clock.now()
+
 	def set(self, key, value, ttl = None):
 		''' Sets data with optional TTL in milliseconds.
         
@@ -21,7 +37,7 @@ class DummyCache:
         '''
 		expiration = None
 		if ttl:
-			expiration = experiment_globals.dummy_time.now() + ttl
+			expiration = self.now() + ttl
 
 		self.data[key] = {"value": value, "expiration": expiration}
 
@@ -35,7 +51,7 @@ class DummyCache:
 		data = self.data.get(key)
 		if not data:
 			return None
-		if 'expiration' in data and data["expiration"] <= experiment_globals.dummy_time.now():
+		if 'expiration' in data and data["expiration"] <= self.now():
 			del self.data[key]
 			return None
 		return data["value"]
@@ -48,6 +64,11 @@ class DummyCache:
 		if isinstance(self.data[key]["value"], int):
 			self.data[key]["value"] += 1
 
+	def __len__(self):
+		''' Number of stored keys, including expired ones that haven't been read since.
+        '''
+		return len(self.data)
+
 	def reset(self):
 		''' Resets the data store.
         '''
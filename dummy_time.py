@@ -1,6 +1,7 @@
 import random
+from clocks import Clock
 
-class DummyTime:
+class DummyTime(Clock):
 	''' Simulated datetime for experiments.
 	'''
 	def __init__(self, rps: float, duration: float, mode='uniform'):
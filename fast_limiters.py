@@ -0,0 +1,237 @@
+'''Fast in-process rate limiters over a compact per-key state table.
+
+Same algorithms and decisions as `rate_limiters.py`, bit for bit, but the state lives in one table per limiter (counter, last time and expiration per key) instead of generic cache entries. The table is compiled C (`_fastlimit.c`) when built:
+
+```bash
+python setup.py build_ext --inplace
+```
+
+and falls back to an equivalent pure-Python table otherwise. `HAVE_COMPILED` tells you which you got. The state is local to the process, so use these where `DummyCache` would do, not in place of a shared store.
+
+Expired keys keep their slot until they're seen again or `purge()` is called, just like `DummyCache` entries.
+
+Run `python fast_limiters.py` to benchmark single-key and high-cardinality workloads.
+'''
+
+import math
+
+from clocks import Clock, MonotonicClock
+
+try:
+	import _fastlimit
+	HAVE_COMPILED = True
+except ImportError:
+	_fastlimit = None
+	HAVE_COMPILED = False
+
+FIXED_WINDOW = 0
+ENFORCED_AVG = 1
+SLIDING_WINDOW = 2
+LEAKY_BUCKET = 3
+
+class _PyTable:
+	''' Pure-Python twin of `_fastlimit.Table`.
+	'''
+
+	def __init__(self, algorithm: int, limit: float, window_length_ms: float, leak_rate: float = 1.0):
+		if algorithm not in (FIXED_WINDOW, ENFORCED_AVG, SLIDING_WINDOW, LEAKY_BUCKET):
+			raise ValueError(f'Invalid algorithm: {algorithm}')
+		if not (limit > 0 and window_length_ms > 0 and leak_rate > 0):
+			raise ValueError('limit, window_length_ms and leak_rate must be positive')
+
+		self.algorithm = algorithm
+		self.limit = limit
+		self.window_length_ms = window_length_ms
+		self.leak_rate = leak_rate
+		self.exclusion_window = 1000 / limit  # enforced average: `limit` is limit_rps
+		self.slots = {}  # key -> [counter, time, expiration, times]
+
+	def allow(self, key: str, now: float) -> dict:
+		slot = self.slots.get(key)
+		if slot is None:
+			slot = self.slots[key] = [0, 0.0, -math.inf, None]
+		exists = slot[2] > now
+		algorithm = self.algorithm
+
+		if algorithm == LEAKY_BUCKET:
+			if exists:
+				counter = max(slot[0] - ((now - slot[1]) * self.leak_rate) / self.window_length_ms, 0)
+				if counter + 1 < self.limit:
+					slot[0] = counter + 1
+					slot[1] = now
+					slot[2] = now + (counter + 1) * self.window_length_ms / self.leak_rate
+					return {"status": "OK", "counter": counter + 1, "new": False}
+				return {"status": "DENIED", "counter": counter, "new": False}
+			slot[0] = 1
+			slot[1] = now
+			slot[2] = now + self.window_length_ms / self.leak_rate
+			return {"status": "OK", "counter": 1, "new": True}
+
+		if algorithm == FIXED_WINDOW:
+			if exists:
+				if slot[0] < self.limit:
+					slot[0] += 1  # does not reset ttl
+					return {"status": "OK", "counter": slot[0]}
+				return {"status": "DENIED", "counter": slot[0]}
+			slot[0] = 1
+			slot[2] = now + self.window_length_ms
+			return {"status": "OK", "counter": 1}
+
+		if algorithm == ENFORCED_AVG:
+			if exists:
+				return {"status": "DENIED"}
+			slot[2] = now + self.exclusion_window
+			return {"status": "OK"}
+
+		# sliding window
+		window_length_ms = self.window_length_ms
+		if exists:
+			times = [time for time in slot[3] if now - time < window_length_ms]
+			if len(times) < self.limit:  # DENIED leaves the stored times untouched
+				times.append(now)
+				slot[3] = times
+				slot[2] = now + window_length_ms
+				return {"status": "OK", "counter": len(times), "new": False}
+			return {"status": "DENIED", "counter": len(times), "new": False}
+		slot[3] = [now]
+		slot[2] = now + window_length_ms
+		return {"status": "OK", "counter": 1, "new": True}
+
+	def purge(self, now: float) -> int:
+		expired = [key for key, slot in self.slots.items() if slot[2] <= now]
+		for key in expired:
+			del self.slots[key]
+		return len(expired)
+
+	def reset(self):
+		self.slots = {}
+
+	def __len__(self):
+		return len(self.slots)
+
+class _FastLimiter:
+	''' Base class; binds the clock and picks the table implementation.
+	'''
+
+	def __init__(self, algorithm: int, limit: float, window_length_ms: float, leak_rate: float, clock: Clock, compiled: bool):
+		''' `compiled`: `True` to require the C table, `False` for pure Python, `None` (default) for C when available.
+		'''
+		if compiled and not HAVE_COMPILED:
+			raise ImportError('_fastlimit is not built; run `python setup.py build_ext --inplace`')
+		use_compiled = HAVE_COMPILED if compiled is None else compiled
+
+		self.clock = clock if clock is not None else MonotonicClock()
+		self.table = (_fastlimit.Table if use_compiled else _PyTable)(algorithm, limit, window_length_ms, leak_rate)
+		self.compiled = use_compiled
+		self._allow = self.table.allow
+
+	def allow(self, key: str) -> dict:
+		''' Rate limits one request for `key`.
+
+		returns: The same dictionary as the matching function in `rate_limiters.py`.
+		'''
+		return self._allow(key, self.clock.now())
+
+	def allow_at(self, key: str, now: float) -> dict:
+		''' Like `allow()`, at time `now` in milliseconds instead of the clock's time.
+		'''
+		return self._allow(key, now)
+
+	def purge(self) -> int:
+		''' Frees the state of keys that have expired.
+
+		returns: The number of keys freed.
+		'''
+		return self.table.purge(self.clock.now())
+
+	def reset(self):
+		self.table.reset()
+
+	def __len__(self):
+		return len(self.table)
+
+class FastFixedWindow(_FastLimiter):
+	''' See `rate_limiters.fixed_window`.
+	'''
+
+	def __init__(self, limit: float, window_length_ms: float = 1000, clock: Clock = None, compiled: bool = None):
+		super().__init__(FIXED_WINDOW, limit, window_length_ms, 1.0, clock, compiled)
+
+class FastEnforcedAvg(_FastLimiter):
+	''' See `rate_limiters.enforced_avg`.
+	'''
+
+	def __init__(self, limit_rps: float, clock: Clock = None, compiled: bool = None):
+		super().__init__(ENFORCED_AVG, limit_rps, 1000, 1.0, clock, compiled)
+
+class FastSlidingWindow(_FastLimiter):
+	''' See `rate_limiters.sliding_window`.
+	'''
+
+	def __init__(self, limit: float, window_length_ms: float = 1000, clock: Clock = None, compiled: bool = None):
+		super().__init__(SLIDING_WINDOW, limit, window_length_ms, 1.0, clock, compiled)
+
+class FastLeakyBucket(_FastLimiter):
+	''' See `rate_limiters.leaky_bucket`.
+	'''
+
+	def __init__(self, limit: float, window_length_ms: float = 1000, mode: str = 'soft', clock: Clock = None, compiled: bool = None):
+		if mode == 'soft':
+			leak_rate = limit  # leak at limit-many requests per window
+		elif mode == 'hard':
+			leak_rate = 1  # leak at 1 request per window
+		else:
+			raise ValueError(f'Invalid mode: {mode}')
+		super().__init__(LEAKY_BUCKET, limit, window_length_ms, leak_rate, clock, compiled)
+
+def benchmark(num_requests: int = 200_000, repeats: int = 3):
+	''' Prints ns / decision for the functional limiter, the pure-Python table and the C table, for one key and for many keys, and checks the decisions match.
+	'''
+	import time
+	import random
+	from functools import partial
+	from clocks import ManualClock
+	from dummy_cache import DummyCache
+	from rate_limiters import fixed_window, sliding_window, leaky_bucket
+
+	random.seed(0)
+	times = sorted(random.uniform(0, num_requests / 20) for _ in range(num_requests))  # ~20 requests / ms
+	clock = ManualClock()
+	cache = DummyCache(clock=clock)
+
+	def run(decide, reset, workload) -> tuple[float, list]:
+		best = float('inf')
+		for _ in range(repeats):
+			reset()
+			results = [None] * num_requests
+			start = time.perf_counter_ns()
+			for idx, key in enumerate(workload):
+				clock.time_ms = times[idx]
+				results[idx] = decide(key)
+			best = min(best, (time.perf_counter_ns() - start) / num_requests)
+		return best, results
+
+	for workload_name, workload in [
+		('single key', ['global'] * num_requests),
+		('100k keys', [f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in (random.randrange(100_000) for _ in range(num_requests))]),
+	]:
+		print(workload_name)
+		for name, function, fast in [
+			('fixed_window', partial(fixed_window, limit=50, window_length_ms=1000, cache=cache), partial(FastFixedWindow, 50, 1000, clock)),
+			('sliding_window', partial(sliding_window, limit=50, window_length_ms=1000, clock=clock, cache=cache), partial(FastSlidingWindow, 50, 1000, clock)),
+			('leaky_bucket', partial(leaky_bucket, limit=50, window_length_ms=1000, mode='soft', clock=clock, cache=cache), partial(FastLeakyBucket, 50, 1000, 'soft', clock)),
+		]:
+			function_ns, expected = run(function, cache.reset, workload)
+			line = f'  {name:>14}: function {function_ns:6.0f} ns'
+			for label, compiled in [('python table', False), ('C table', True)]:
+				if compiled and not HAVE_COMPILED:
+					line += f', {label} not built'
+					continue
+				limiter = fast(compiled=compiled)
+				table_ns, got = run(limiter.allow, limiter.reset, workload)
+				match = 'identical' if got == expected else 'MISMATCH'
+				line += f', {label} {table_ns:6.0f} ns (x{function_ns / table_ns:.1f}, {match})'
+			print(line)
+
+if __name__ == "__main__":
+	benchmark()
@@ -0,0 +1,76 @@
+'''Import-time benchmark.
+
+Imports each module in a fresh interpreter and reports the median time the `import` statement took, plus any heavy or experiment-only modules it pulled in. The core limiter modules must not load pandas, plotly, rich or numpy, nor build the experiments' `DummyTime` / `DummyCache` (`experiment_globals`). The script exits non-zero if one does.
+
+Run `python import_time.py [repeats]`.
+'''
+
+import sys
+import json
+import statistics
+import subprocess
+
+CORE = [
+	'clocks',
+	'dummy_cache',
+	'rate_limiters',
+	'policies',
+	'fast_limiters',
+	'sketch_limiter',
+	'shared_memory_cache',
+	'limiter_service',
+	'concurrency',
+	'shaping',
+	'adaptive',
+	'snapshot',
+	'instrumentation',
+	'capacity_model',
+	'middleware',
+]
+EXTRAS = ['plot', 'main']  # need `requirements.txt`
+
+HEAVY = ['pandas', 'plotly', 'rich', 'numpy', 'experiment_globals']
+NOTABLE = HEAVY + ['asyncio', 'multiprocessing', 'dataclasses', 'inspect', 'typing']
+
+_PROBE = '''
+import sys, time, json
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted(set(sys.modules) - before)]))
+'''
+
+def measure(module: str, repeats: int = 7) -> tuple[float, list[str]] | None:
+	''' returns: The median import time in ms and the notable modules it loaded, or None if it can't be imported.
+	'''
+	times = []
+	loaded = []
+	for _ in range(repeats):
+		process = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)], capture_output=True, text=True)
+		if process.returncode:
+			return None
+		elapsed, new_modules = json.loads(process.stdout.strip().splitlines()[-1])
+		times.append(elapsed * 1000)
+		loaded = [name for name in NOTABLE if name in new_modules]
+	return statistics.median(times), loaded
+
+if __name__ == "__main__":
+	repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+	failures = []
+
+	for group, modules in [('core', CORE), ('extras', EXTRAS)]:
+		print(group)
+		for module in modules:
+			result = measure(module, repeats)
+			if result is None:
+				print(f'  {module:>20}: not importable here (missing dependencies?)')
+				continue
+			ms, loaded = result
+			print(f'  {module:>20}: {ms:7.1f} ms  {", ".join(loaded)}')
+			if group == 'core' and any(name in loaded for name in HEAVY):
+				failures.append(module)
+
+	if failures:
+		print(f'\ncore modules loading heavy or experiment-only modules: {", ".join(failures)}')
+	sys.exit(1 if failures else 0)
@@ -0,0 +1,328 @@
+'''Optional instrumentation for the rate limiters.
+
+Wrap a limiter with `instrument()` and its cache with `instrument_cache()`, then pull `Metrics.snapshot()` whenever you want numbers:
+
+- decisions per algorithm and status
+- limiter latency and backend (cache) latency histograms
+- compute time per decision, i.e. limiter latency minus backend time. For `sliding_window` this is the list rebuild
+- keys tracked by the cache
+- top-N denied keys, from a Space-Saving heavy-hitters sketch
+
+Metrics are plain counters updated in-process; nothing is exported or pushed.
+
+If `Metrics.enabled` is `False` when wrapping, `instrument()` and `instrument_cache()` hand back the original function and cache, so disabled metrics cost nothing. Flipping `enabled` off after wrapping pauses recording, but the wrappers still cost a call and a flag check. Run `python instrumentation.py` to measure the overhead.
+'''
+
+import time
+import functools
+from collections import defaultdict
+from typing import Any, Callable
+
+class Histogram:
+	''' Latency histogram with power-of-2 nanosecond buckets. Recording is a `bit_length()`, a list increment and a running total; the count is the sum of the buckets.
+	'''
+
+	NUM_BUCKETS = 48  # up to ~78 hours
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.buckets = [0] * self.NUM_BUCKETS
+		self.total_ns = 0
+		self.max_ns = 0
+
+	@property
+	def count(self) -> int:
+		return sum(self.buckets)
+
+	def record(self, ns: int):
+		bucket = ns.bit_length()
+		self.buckets[bucket if bucket < 48 else 47] += 1  # 48 == NUM_BUCKETS, inlined
+		self.total_ns += ns
+		if ns > self.max_ns:
+			self.max_ns = ns
+
+	def percentile(self, p: float) -> int:
+		''' returns: Upper bound, in nanoseconds, of the bucket containing the `p`-th percentile (0-100).
+		'''
+		count = self.count
+		if count == 0:
+			return 0
+		target = p / 100 * count
+		seen = 0
+		for idx, n in enumerate(self.buckets):
+			seen += n
+			if seen >= target:
+				return min(1 << idx, self.max_ns)
+		return self.max_ns
+
+	def snapshot(self) -> dict:
+		count = self.count
+		return {
+			'count': count,
+			'mean_ns': self.total_ns / count if count else 0,
+			'p50_ns': self.percentile(50),
+			'p90_ns': self.percentile(90),
+			'p99_ns': self.percentile(99),
+			'max_ns': self.max_ns,
+		}
+
+class SpaceSaving:
+	''' Space-Saving heavy-hitters sketch. Tracks at most `capacity` keys; any key seen more than `total / capacity` times is guaranteed to be in it, and each count overestimates by at most `total / capacity`.
+
+	Keys are also grouped by count (the "stream summary"), and the smallest count is tracked, so every update, including an eviction, is O(1).
+	'''
+
+	def __init__(self, capacity: int = 100):
+		self.capacity = capacity
+		self.counts = {}
+		self.by_count = {}  # count -> keys with that count
+		self.min_count = 0
+		self.total = 0
+
+	def add(self, key: str):
+		self.total += 1
+		counts = self.counts
+		by_count = self.by_count
+		count = counts.get(key)
+
+		if count is None:
+			if len(counts) < self.capacity:
+				count = 0
+			else:  # evict a key with the smallest count; the new key inherits it
+				count = self.min_count
+				del counts[by_count[count].pop()]
+
+		if count:
+			keys = by_count[count]
+			keys.discard(key)
+			if not keys:
+				del by_count[count]
+
+		count += 1
+		counts[key] = count
+		keys = by_count.get(count)
+		if keys is None:
+			by_count[count] = {key}
+		else:
+			keys.add(key)
+
+		if count == 1:
+			self.min_count = 1
+		elif count - 1 == self.min_count and count - 1 not in by_count:  # the smallest count's last key moved up
+			self.min_count = count
+
+	def top(self, n: int) -> list[tuple[str, int]]:
+		''' returns: The `n` heaviest keys and their (over)estimated counts, heaviest first.
+		'''
+		return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+class Metrics:
+	''' Collects limiter and backend metrics.
+	'''
+
+	def __init__(self, enabled: bool = True, top_n: int = 10, sketch_capacity: int = 100):
+		''' `enabled`: Whether to record anything. Can be flipped at runtime.
+
+		`top_n`: Number of denied keys reported by `snapshot()`.
+
+		`sketch_capacity`: Number of keys the heavy-hitters sketch tracks. Larger is more accurate.
+		'''
+		self.enabled = enabled
+		self.top_n = top_n
+		self.sketch_capacity = sketch_capacity
+		self.caches = []
+		self.decisions = defaultdict(lambda: defaultdict(int))
+		self.latency = defaultdict(Histogram)
+		self.compute = defaultdict(Histogram)
+		self.backend = defaultdict(Histogram)
+		self.backend_ns = 0  # running total, used to split limiter latency into backend and compute
+		self.denied_keys = SpaceSaving(sketch_capacity)
+
+	def reset(self):
+		''' Clears all metrics. Clears in place, since the wrappers hold on to the counters and histograms.
+		'''
+		for statuses in self.decisions.values():
+			statuses.clear()
+		for hists in (self.latency, self.compute, self.backend):
+			for hist in hists.values():
+				hist.reset()
+		self.backend_ns = 0
+		self.denied_keys = SpaceSaving(self.sketch_capacity)
+
+	def snapshot(self) -> dict:
+		''' returns: A plain dictionary of the current metrics.
+		'''
+		keys_tracked = None
+		for cache in self.caches:
+			try:
+				keys_tracked = (keys_tracked or 0) + len(cache)
+			except TypeError:  # backend can't count its keys
+				pass
+
+		return {
+			'decisions': {name: dict(statuses) for name, statuses in self.decisions.items()},
+			'latency': {name: hist.snapshot() for name, hist in self.latency.items()},
+			'compute': {name: hist.snapshot() for name, hist in self.compute.items()},
+			'backend': {op: hist.snapshot() for op, hist in self.backend.items()},
+			'keys_tracked': keys_tracked,
+			'top_denied': self.denied_keys.top(self.top_n),
+		}
+
+def instrument(rate_limiter: Callable, metrics: Metrics, name: str = None) -> Callable:
+	''' Wraps a rate limiter so each call is recorded in `metrics`.
+
+	`rate_limiter`: Any function from `rate_limiters.py`.
+
+	`metrics`: Where to record. If `None` or disabled, `rate_limiter` is returned as is.
+
+	`name`: Name used in the metrics. Defaults to the function name; pass e.g. `'leaky_bucket_hard'` to tell modes apart.
+
+	returns: A function with the same signature and results as `rate_limiter`.
+	'''
+	if metrics is None or not metrics.enabled:
+		return rate_limiter
+
+	name = name or rate_limiter.__name__
+	decisions = metrics.decisions[name]
+	latency = metrics.latency[name]
+	compute = metrics.compute[name]
+	perf_counter_ns = time.perf_counter_ns
+
+	@functools.wraps(rate_limiter)
+	def instrumented(key, *args, **kwargs):
+		if not metrics.enabled:
+			return rate_limiter(key, *args, **kwargs)
+
+		backend_before = metrics.backend_ns
+		start = perf_counter_ns()
+		result = rate_limiter(key, *args, **kwargs)
+		elapsed = perf_counter_ns() - start
+
+		latency.record(elapsed)
+		compute.record(max(elapsed - (metrics.backend_ns - backend_before), 0))
+		status = result['status']
+		decisions[status] += 1
+		if status == 'DENIED':
+			metrics.denied_keys.add(key)
+
+		return result
+
+	return instrumented
+
+class InstrumentedCache:
+	''' Wraps a data store (`DummyCache`, `SharedMemoryCache`, ...) and times its `get()`, `set()` and `incr()`. Use `instrument_cache()` to create one.
+	'''
+
+	def __init__(self, cache, metrics: Metrics):
+		self.cache = cache
+		self.metrics = metrics
+		self._get = metrics.backend['get']
+		self._set = metrics.backend['set']
+		self._incr = metrics.backend['incr']
+		metrics.caches.append(cache)
+
+	def get(self, key: str) -> Any:
+		metrics = self.metrics
+		if not metrics.enabled:
+			return self.cache.get(key)
+		start = time.perf_counter_ns()
+		result = self.cache.get(key)
+		elapsed = time.perf_counter_ns() - start
+		self._get.record(elapsed)
+		metrics.backend_ns += elapsed
+		return result
+
+	def set(self, key, value, ttl = None):
+		metrics = self.metrics
+		if not metrics.enabled:
+			return self.cache.set(key, value, ttl)
+		start = time.perf_counter_ns()
+		self.cache.set(key, value, ttl)
+		elapsed = time.perf_counter_ns() - start
+		self._set.record(elapsed)
+		metrics.backend_ns += elapsed
+
+	def incr(self, key):
+		metrics = self.metrics
+		if not metrics.enabled:
+			return self.cache.incr(key)
+		start = time.perf_counter_ns()
+		self.cache.incr(key)
+		elapsed = time.perf_counter_ns() - start
+		self._incr.record(elapsed)
+		metrics.backend_ns += elapsed
+
+	def __getattr__(self, name):  # reset(), lock(), ... go straight to the wrapped cache
+		return getattr(self.cache, name)
+
+	def __len__(self):
+		return len(self.cache)
+
+def instrument_cache(cache, metrics: Metrics):
+	''' Wraps `cache` so its operations are timed in `metrics`.
+
+	returns: An `InstrumentedCache`, or `cache` itself if `metrics` is `None` or disabled.
+	'''
+	if metrics is None or not metrics.enabled:
+		return cache
+	return InstrumentedCache(cache, metrics)
+
+def measure_overhead(num_requests: int = 200_000, repeats: int = 5) -> dict:
+	''' Times `leaky_bucket` raw, wrapped while metrics were disabled, wrapped and then paused, and wrapped with metrics enabled.
+
+	returns: Best-of-`repeats` nanoseconds per decision for each.
+	'''
+	from rate_limiters import leaky_bucket
+	from clocks import ManualClock
+	from dummy_cache import DummyCache
+
+	clock = ManualClock()
+	cache = DummyCache(clock=clock)
+	keys = [f'10.0.0.{i % 256}' for i in range(num_requests)]
+
+	def run(limiter, limiter_cache):
+		best = float('inf')
+		for _ in range(repeats):
+			cache.reset()
+			start = time.perf_counter_ns()
+			for i, key in enumerate(keys):
+				clock.time_ms = i * 0.1
+				limiter(key, 5, 1000, 'soft', clock, limiter_cache)
+			best = min(best, (time.perf_counter_ns() - start) / num_requests)
+		return best
+
+	results = {'raw': run(leaky_bucket, cache)}
+
+	disabled = Metrics(enabled=False)
+	results['disabled'] = run(instrument(leaky_bucket, disabled), instrument_cache(cache, disabled))
+
+	metrics = Metrics()
+	limiter, limiter_cache = instrument(leaky_bucket, metrics), instrument_cache(cache, metrics)
+	metrics.enabled = False
+	results['paused'] = run(limiter, limiter_cache)
+	metrics.enabled = True
+	results['enabled'] = run(limiter, limiter_cache)
+	return results
+
+if __name__ == "__main__":
+	from pprint import pprint
+
+	results = measure_overhead()
+	for mode, ns in results.items():
+		print(f'{mode:>9}: {ns:7.0f} ns / decision  ({(ns / results["raw"] - 1) * 100:+5.1f} %)')
+
+	# example snapshot
+	from rate_limiters import sliding_window
+	from clocks import ManualClock
+	from dummy_cache import DummyCache
+
+	clock = ManualClock()
+	metrics = Metrics()
+	cache = instrument_cache(DummyCache(clock=clock), metrics)
+	limiter = instrument(sliding_window, metrics)
+	for i in range(10_000):
+		clock.set(i * 2.0)
+		limiter('abusive' if i % 2 else f'user-{i % 50}', limit=50, window_length_ms=1000, clock=clock, cache=cache)
+	pprint(metrics.snapshot())
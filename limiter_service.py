@@ -0,0 +1,216 @@
+'''Local multi-core rate limiter service.
+
+A single Python process can only make rate limiting decisions on one core (GIL). `LimiterService` hash-partitions keys across N worker processes. Each worker owns its own cache shard, so a key always lands on the same worker and its state is never shared. Clients send batches of keys over Unix socket pipes and get the answers back in request order.
+
+Requests are stamped with a time by the client, and workers decide at that time. Answers are therefore identical to calling the limiter in a single process with the same timestamps.
+
+The client partitions each batch, pickles it out to the workers and merges the answers back, all in one process. That serial share caps the service however many cores the workers get; the benchmark prints the cap next to the measured throughput.
+
+Run `python limiter_service.py` for the scaling benchmark.
+'''
+
+import os
+import sys
+import time
+import zlib
+import multiprocessing as mp
+from typing import Callable
+
+from clocks import Clock, ManualClock, MonotonicClock
+
+def shard_of(key: str, num_shards: int) -> int:
+	''' Stable shard index for `key`. Unlike `hash()`, it's the same in every process.
+	'''
+	return zlib.crc32(key.encode()) % num_shards
+
+def _worker(conn, rate_limiter_name: str, limiter_args: dict):
+	''' Worker loop. Receives `(keys, times)` batches and sends back the list of limiter results.
+	'''
+	import inspect
+	import rate_limiters
+	from dummy_cache import DummyCache
+
+	clock = ManualClock()
+	rate_limiter = getattr(rate_limiters, rate_limiter_name)
+	kwargs = dict(limiter_args, cache=DummyCache(clock=clock))  # TTLs follow the request timestamps
+	if 'clock' in inspect.signature(rate_limiter).parameters:
+		kwargs['clock'] = clock
+
+	while True:
+		batch = conn.recv()
+		if batch is None:  # shutdown
+			break
+
+		keys, times = batch
+		results = []
+		for key, time_ms in zip(keys, times):
+			clock.set(time_ms)
+			results.append(rate_limiter(key, **kwargs))
+		conn.send(results)
+
+	conn.close()
+
+def _partition(keys: list[str], times: list[float], num_shards: int) -> tuple[list, list, list]:
+	''' returns: The keys, times and batch positions of each shard, in request order.
+	'''
+	shard_keys = [[] for _ in range(num_shards)]
+	shard_times = [[] for _ in range(num_shards)]
+	shard_positions = [[] for _ in range(num_shards)]
+
+	for position, (key, time_ms) in enumerate(zip(keys, times)):
+		shard = shard_of(key, num_shards)
+		shard_keys[shard].append(key)
+		shard_times[shard].append(time_ms)
+		shard_positions[shard].append(position)
+
+	return shard_keys, shard_times, shard_positions
+
+class LimiterService:
+	''' Rate limiter sharded across worker processes.
+	'''
+
+	def __init__(self, rate_limiter: Callable | str, limiter_args: dict, workers: int = None, clock: Clock = None):
+		''' Starts the worker processes.
+
+		`rate_limiter`: A function from `rate_limiters.py` (or its name), e.g. `leaky_bucket`.
+
+		`limiter_args`: Keyword arguments for the rate limiter, without `key`, e.g. `{'limit': 5, 'window_length_ms': 1000}`.
+
+		`workers`: Number of worker processes. Defaults to the number of cores.
+
+		`clock`: Clock used to stamp requests that don't come with a time. Defaults to `MonotonicClock`.
+		'''
+		name = rate_limiter if isinstance(rate_limiter, str) else rate_limiter.__name__
+		self.num_workers = workers or os.cpu_count() or 1
+		self.clock = clock if clock is not None else MonotonicClock()
+		self._conns = []
+		self._procs = []
+
+		for _ in range(self.num_workers):
+			parent_conn, child_conn = mp.Pipe()  # a Unix socketpair on POSIX
+			proc = mp.Process(target=_worker, args=(child_conn, name, limiter_args), daemon=True)
+			proc.start()
+			child_conn.close()
+			self._conns.append(parent_conn)
+			self._procs.append(proc)
+
+	def check(self, keys: list[str], times: list[float] = None) -> list[dict]:
+		''' Rate limits a batch of requests.
+
+		`keys`: The keys to rate limit, one per request. Duplicates are fine and are decided in order.
+
+		`times`: Time of each request in milliseconds. Defaults to the service clock for the whole batch.
+
+		returns: The rate limiter results, in the same order as `keys`.
+		'''
+		if times is None:
+			times = [self.clock.now()] * len(keys)
+
+		n = self.num_workers
+		shard_keys, shard_times, shard_positions = _partition(keys, times, n)
+
+		# send everything first so the workers run in parallel
+		for shard in range(n):
+			if shard_keys[shard]:
+				self._conns[shard].send((shard_keys[shard], shard_times[shard]))
+
+		results = [None] * len(keys)
+		for shard in range(n):
+			if shard_keys[shard]:
+				for position, result in zip(shard_positions[shard], self._conns[shard].recv()):
+					results[position] = result
+
+		return results
+
+	def close(self):
+		''' Stops the worker processes.
+		'''
+		for conn in self._conns:
+			try:
+				conn.send(None)
+			except (BrokenPipeError, OSError):
+				pass
+			conn.close()
+		for proc in self._procs:
+			proc.join()
+		self._conns = []
+		self._procs = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+def _single_process(rate_limiter: Callable, limiter_args: dict, keys: list[str], times: list[float]) -> list[dict]:
+	''' Reference run of `rate_limiter` in this process, using the same timestamps as the service.
+	'''
+	import inspect
+	from dummy_cache import DummyCache
+
+	clock = ManualClock()
+	kwargs = dict(limiter_args, cache=DummyCache(clock=clock))
+	if 'clock' in inspect.signature(rate_limiter).parameters:
+		kwargs['clock'] = clock
+
+	results = []
+	for key, time_ms in zip(keys, times):
+		clock.set(time_ms)
+		results.append(rate_limiter(key, **kwargs))
+	return results
+
+def _client_ceiling(keys: list[str], times: list[float], results: list[dict], workers: int, batch_size: int) -> float:
+	''' returns: Decisions / sec if the workers answered instantly: the client's serial share of `check()` (partitioning, pickling to and from the pipes, merging), timed on its own.
+	'''
+	import pickle
+
+	start = time.perf_counter()
+	for i in range(0, len(keys), batch_size):
+		batch_keys, batch_times, batch_results = keys[i:i + batch_size], times[i:i + batch_size], results[i:i + batch_size]
+		shard_keys, shard_times, shard_positions = _partition(batch_keys, batch_times, workers)
+		merged = [None] * len(batch_keys)
+		for shard in range(workers):
+			if shard_keys[shard]:
+				pickle.dumps((shard_keys[shard], shard_times[shard]), pickle.HIGHEST_PROTOCOL)
+				answers = pickle.loads(pickle.dumps([batch_results[position] for position in shard_positions[shard]], pickle.HIGHEST_PROTOCOL))
+				for position, result in zip(shard_positions[shard], answers):
+					merged[position] = result
+	return len(keys) / (time.perf_counter() - start)
+
+def benchmark(num_requests: int = 200_000, num_keys: int = 10_000, batch_size: int = 20_000, max_workers: int = None):
+	''' Prints decisions / sec for the single-process limiters and the service at 1, 2, 4, ... workers, and checks the answers match.
+	'''
+	import random
+	from rate_limiters import fixed_window, leaky_bucket
+
+	random.seed(0)
+	keys = [f'10.0.{i // 256}.{i % 256}' for i in range(num_keys)]
+	workload = [random.choice(keys) for _ in range(num_requests)]
+	times = [i * 0.05 for i in range(num_requests)]  # 20k rps
+
+	max_workers = max_workers or os.cpu_count() or 1
+	worker_counts = sorted({2 ** i for i in range(max_workers.bit_length()) if 2 ** i <= max_workers} | {max_workers})
+
+	for rate_limiter, limiter_args in [
+		(fixed_window, {'limit': 5, 'window_length_ms': 1000}),
+		(leaky_bucket, {'limit': 5, 'window_length_ms': 1000, 'mode': 'soft'}),
+	]:
+		start = time.perf_counter()
+		expected = _single_process(rate_limiter, limiter_args, workload, times)
+		elapsed = time.perf_counter() - start
+		print(f'{rate_limiter.__name__:>14}  single process  {num_requests / elapsed:>12,.0f} decisions/s')
+
+		for workers in worker_counts:
+			with LimiterService(rate_limiter, limiter_args, workers=workers) as service:
+				start = time.perf_counter()
+				got = []
+				for i in range(0, num_requests, batch_size):
+					got += service.check(workload[i:i + batch_size], times[i:i + batch_size])
+				elapsed = time.perf_counter() - start
+
+			match = 'identical' if got == expected else 'MISMATCH'
+			ceiling = _client_ceiling(workload, times, expected, workers, batch_size)
+			print(f'{rate_limiter.__name__:>14}  {workers:>2} workers      {num_requests / elapsed:>12,.0f} decisions/s  ({match}; client-side cap {ceiling:,.0f})')
+
+if __name__ == "__main__":
+	benchmark(max_workers=int(sys.argv[1]) if len(sys.argv) > 1 else None)
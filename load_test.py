@@ -0,0 +1,391 @@
+'''End-to-end load test of the rate limiters behind a real local HTTP server.
+
+Serves a tiny app wrapped in `middleware.py` from a separate process on localhost and sends it requests from an open-loop load generator. The requests go out at the arrival times of a `DummyTime` workload mode (`uniform`, `random` or `cross_window`), scaled to the target rate, and each request is keyed by an `x-client` header picked round-robin from `num_keys` keys. Latency is measured from when a request was *due*, not when it was sent, so a server that falls behind can't hide it by slowing the generator down (coordinated omission).
+
+For each algorithm and backend it reports:
+
+- `p50` / `p99`: latency at the reference rate, and `added p99`, the p99 it adds over a server with no limiter (median of paired runs)
+- `limiter us`: p99 of the time spent in the limiter call, measured inside the server. Localhost round trips jitter by more than a limiter decision costs, so this is the stable number to compare backends by
+- `max rps`: the highest rate the server keeps up with: every request answered, throughput at least 95% of the offered rate, and p99 within `slo_ms`
+
+Backends:
+
+- `functions`: the `rate_limiters.py` functions over a `DummyCache`
+- `policies`: the `policies.py` classes
+- `fast`: the `fast_limiters.py` tables (compiled if built)
+- `shared`: the functions over a `SharedMemoryCache`, under its stripe lock (`sliding_window` isn't supported there)
+
+The generator and the server share the machine, so `max rps` is a lower bound on what the server alone can do; compare each row with the no-limiter row. Run `python load_test.py [asgi|wsgi] [mode]`.
+'''
+
+import sys
+import json
+import math
+import time
+import socket
+import asyncio
+import functools
+from collections import Counter
+from typing import Callable
+
+from clocks import MonotonicClock
+from dummy_time import DummyTime
+
+ALGORITHMS = ['fixed_window', 'enforced_avg', 'sliding_window', 'leaky_bucket']
+BACKENDS = ['functions', 'policies', 'fast', 'shared']
+_CLASS_NAMES = {
+	'fixed_window': 'FixedWindow',
+	'enforced_avg': 'EnforcedAvg',
+	'sliding_window': 'SlidingWindow',
+	'leaky_bucket': 'LeakyBucket',
+}
+
+def make_limiter(algorithm: str, backend: str, limit: float, window_length_ms: float = 1000) -> tuple[Callable[[str], dict], Callable]:
+	''' Builds a limiter for the middleware.
+
+	`algorithm`: One of `ALGORITHMS`.
+
+	`backend`: One of `BACKENDS`.
+
+	`limit`: Requests per `window_length_ms` per key; for `enforced_avg`, requests per second.
+
+	returns: The limiter, called with a key, and a function that frees its resources.
+	'''
+	if algorithm not in ALGORITHMS:
+		raise ValueError(f'Invalid algorithm: {algorithm}')
+	if backend not in BACKENDS:
+		raise ValueError(f'Invalid backend: {backend}')
+
+	clock = MonotonicClock()
+	if algorithm == 'enforced_avg':
+		args = {'limit_rps': limit}
+	else:
+		args = {'limit': limit, 'window_length_ms': window_length_ms}
+
+	if backend == 'policies':
+		import policies
+		return getattr(policies, _CLASS_NAMES[algorithm])(**args, clock=clock).allow, lambda: None
+
+	if backend == 'fast':
+		import fast_limiters
+		return getattr(fast_limiters, 'Fast' + _CLASS_NAMES[algorithm])(**args, clock=clock).allow, lambda: None
+
+	import rate_limiters
+	rate_limiter = getattr(rate_limiters, algorithm)
+	if algorithm in ('sliding_window', 'leaky_bucket'):
+		args['clock'] = clock
+
+	if backend == 'functions':
+		from dummy_cache import DummyCache
+		return functools.partial(rate_limiter, cache=DummyCache(clock=clock), **args), lambda: None
+
+	if algorithm == 'sliding_window':
+		raise ValueError('SharedMemoryCache does not support sliding_window')
+	from shared_memory_cache import SharedMemoryCache
+	cache = SharedMemoryCache(clock=clock)
+
+	def close():
+		cache.close()
+		cache.unlink()
+
+	return functools.partial(cache.limit, rate_limiter, **args), close
+
+async def _hello_asgi(scope, receive, send):
+	await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/plain')]})
+	await send({'type': 'http.response.body', 'body': b'OK'})
+
+def _hello_wsgi(environ, start_response):
+	start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+	return [b'OK']
+
+def _header_key_asgi(scope: dict) -> str:
+	for name, value in scope['headers']:
+		if name == b'x-client':
+			return value.decode()
+	return ''
+
+def _header_key_wsgi(environ: dict) -> str:
+	return environ.get('HTTP_X_CLIENT', '')
+
+_TIMINGS_PATH = '/_timings'
+
+def _serve(sock: socket.socket, server: str, limiter: Callable[[str], dict] | None):
+	''' Server process: serves the hello app on `sock`, behind the middleware unless `limiter` is None.
+
+	Also records how long each limiter call takes, and serves (and clears) the list in ns as JSON at `_TIMINGS_PATH`, outside the middleware.
+	'''
+	import middleware
+
+	timings = []
+	if limiter is not None:
+		decide = limiter
+
+		def limiter(key: str) -> dict:
+			start = time.perf_counter_ns()
+			result = decide(key)
+			timings.append(time.perf_counter_ns() - start)
+			return result
+
+	def take_timings() -> bytes:
+		body = json.dumps(timings).encode()
+		timings.clear()
+		return body
+
+	if server == 'asgi':
+		limited = _hello_asgi if limiter is None else middleware.ASGIRateLimiter(_hello_asgi, limiter, key=_header_key_asgi)
+
+		async def app(scope, receive, send):
+			if scope['path'] != _TIMINGS_PATH:
+				await limited(scope, receive, send)
+				return
+			await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+			await send({'type': 'http.response.body', 'body': take_timings()})
+
+		asyncio.run(middleware.serve_asgi(app, sock=sock))
+	else:
+		limited = _hello_wsgi if limiter is None else middleware.WSGIRateLimiter(_hello_wsgi, limiter, key=_header_key_wsgi)
+
+		def app(environ, start_response):
+			if environ['PATH_INFO'] != _TIMINGS_PATH:
+				return limited(environ, start_response)
+			body = take_timings()
+			start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+			return [body]
+
+		middleware.serve_wsgi(app, sock=sock)
+
+class LocalServer:
+	''' Runs the hello app behind the middleware in a forked process on a free localhost port.
+	'''
+
+	def __init__(self, server: str = 'asgi', limiter: Callable[[str], dict] = None):
+		''' `server`: `'asgi'` (`serve_asgi`, keep-alive) or `'wsgi'` (`serve_wsgi`, a connection per request).
+
+		`limiter`: The limiter the middleware applies. None serves the app without middleware, as a baseline.
+		'''
+		if server not in ('asgi', 'wsgi'):
+			raise ValueError(f'Invalid server: {server}')
+
+		import multiprocessing as mp
+
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		sock.bind(('127.0.0.1', 0))
+		sock.listen(1024)  # connections queue here until the server process accepts them, so no readiness handshake is needed
+		self.host, self.port = sock.getsockname()
+
+		self._process = mp.get_context('fork').Process(target=_serve, args=(sock, server, limiter), daemon=True)  # fork: the limiter (and any shared memory) is inherited
+		self._process.start()
+		sock.close()
+
+	def take_timings(self) -> list[int]:
+		''' returns: The time of each limiter call, in ns, since the last call to this.
+		'''
+		import http.client
+		connection = http.client.HTTPConnection(self.host, self.port)
+		try:
+			connection.request('GET', _TIMINGS_PATH)
+			return json.loads(connection.getresponse().read())
+		finally:
+			connection.close()
+
+	def close(self):
+		self._process.terminate()
+		self._process.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+async def _read_response(reader: asyncio.StreamReader) -> tuple[int, bool]:
+	''' returns: The status code, and whether the connection can be reused.
+	'''
+	head = await reader.readuntil(b'\r\n\r\n')
+	status_line, *header_lines = head[:-4].split(b'\r\n')
+	version, status = status_line.split(b' ', 2)[:2]
+
+	length = 0
+	keep_alive = version == b'HTTP/1.1'
+	for line in header_lines:
+		name, _, value = line.partition(b':')
+		name = name.strip().lower()
+		if name == b'content-length':
+			length = int(value)
+		elif name == b'connection':
+			keep_alive = value.strip().lower() == b'keep-alive'
+	if length:
+		await reader.readexactly(length)
+	return int(status), keep_alive
+
+async def run_load(host: str, port: int, times_ms: list[float], num_keys: int = 1000, connections: int = 64, timeout_s: float = 5.0) -> dict:
+	''' Sends one request per entry of `times_ms`, at that many milliseconds from the start, over up to `connections` connections.
+
+	returns: A dictionary with `latencies_ms` (sorted, answered requests only), `statuses` (count per status code), `errors` (failed or unanswered requests) and `throughput_rps` (answered requests per second of the run).
+	'''
+	loop = asyncio.get_running_loop()
+	requests = [f'GET / HTTP/1.1\r\nhost: {host}\r\nx-client: k{i}\r\n\r\n'.encode() for i in range(num_keys)]
+	pool = asyncio.Queue()
+	for _ in range(connections):
+		pool.put_nowait(None)  # connected on first use
+
+	latencies = []
+	statuses = Counter()
+	errors = 0
+	last_done = 0.0
+
+	async def one(i: int, due: float):
+		nonlocal errors, last_done
+		conn = await pool.get()
+		try:
+			if conn is None:
+				conn = await asyncio.open_connection(host, port)
+			reader, writer = conn
+			writer.write(requests[i % num_keys])
+			status, keep_alive = await _read_response(reader)
+			last_done = loop.time()
+			latencies.append((last_done - due) * 1000)
+			statuses[status] += 1
+			if not keep_alive:
+				writer.close()
+				conn = None
+		except (OSError, asyncio.IncompleteReadError, ValueError):
+			errors += 1
+			if conn is not None:
+				conn[1].close()
+			conn = None
+		finally:
+			pool.put_nowait(conn)
+
+	start = loop.time() + 0.01
+	tasks = []
+	for i, time_ms in enumerate(times_ms):
+		due = start + time_ms / 1000
+		delay = due - loop.time()
+		if delay > 0.001:  # anything closer is sent in this batch
+			await asyncio.sleep(delay)
+		tasks.append(asyncio.create_task(one(i, due)))
+
+	done, pending = await asyncio.wait(tasks, timeout=timeout_s) if tasks else (set(), set())
+	for task in pending:
+		task.cancel()
+	await asyncio.gather(*pending, return_exceptions=True)
+	while not pool.empty():
+		conn = pool.get_nowait()
+		if conn is not None:
+			conn[1].close()
+
+	elapsed = last_done - start
+	return {
+		'latencies_ms': sorted(latencies),
+		'statuses': dict(statuses),
+		'errors': errors + len(pending),
+		'throughput_rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+	}
+
+def percentile(sorted_values: list[float], q: float) -> float:
+	''' Nearest-rank percentile of an already sorted list, `q` in [0, 100].
+	'''
+	if not sorted_values:
+		return math.nan
+	return sorted_values[max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)]
+
+def workload(rps: float, duration: float, mode: str = 'uniform') -> list[float]:
+	''' returns: Request times in milliseconds from a `DummyTime` mode.
+	'''
+	if mode not in ('uniform', 'random', 'cross_window'):
+		raise ValueError(f'Invalid mode: {mode}')
+	return DummyTime(rps, duration, mode).times
+
+def sustainable(result: dict, offered_rps: float, slo_ms: float) -> bool:
+	''' Whether the server kept up with a run: every request answered, at least 95% of the offered throughput, and p99 within `slo_ms`.
+	'''
+	return (
+		result['errors'] == 0
+		and result['throughput_rps'] >= 0.95 * offered_rps
+		and percentile(result['latencies_ms'], 99) <= slo_ms
+	)
+
+def max_rps(host: str, port: int, mode: str = 'uniform', duration: float = 1.0, slo_ms: float = 50.0, start_rps: float = 500, refine_steps: int = 3, attempts: int = 2, **load_args) -> float:
+	''' Highest sustainable rate: doubles the rate from `start_rps` until a run isn't `sustainable`, then bisects `refine_steps` times. A rate passes if any of `attempts` runs is sustainable, so one hiccup on a shared machine doesn't end the search.
+
+	returns: The highest rate that passed, or 0 if `start_rps` already failed.
+	'''
+	def passes(rps: float) -> bool:
+		return any(
+			sustainable(asyncio.run(run_load(host, port, workload(rps, duration, mode), **load_args)), rps, slo_ms)
+			for _ in range(attempts)
+		)
+
+	low, high = 0.0, start_rps
+	while passes(high):
+		low, high = high, high * 2
+	for _ in range(refine_steps if low else 0):
+		middle = (low + high) / 2
+		if passes(middle):
+			low = middle
+		else:
+			high = middle
+	return low
+
+def benchmark(server: str = 'asgi', mode: str = 'uniform', algorithms: list[str] = ALGORITHMS, backends: list[str] = BACKENDS, reference_rps: float = 500, duration: float = 1.0, num_keys: int = 1000, limit: float = 10, slo_ms: float = 50.0, repeats: int = 5):
+	''' Prints latency at `reference_rps` and the max sustainable rate for each algorithm and backend, and for the app with no limiter.
+
+	Each reference run with a limiter is paired with a run against a server without one, kept up for the whole benchmark, and `added p99` is the median difference of the pairs. That cancels most of the drift in localhost latency, but differences well under the round trip are still within noise.
+
+	`limit`: Per key, per second. With the default 1000 keys, the limiters start denying around `1000 * limit` rps.
+
+	`repeats`: Reference runs per row; medians are reported.
+	'''
+	load_args = {'num_keys': num_keys, 'connections': 16 if server == 'asgi' else 64}
+	times_ms = workload(reference_rps, duration, mode)
+
+	def reference_run(local: LocalServer) -> dict:
+		return asyncio.run(run_load(local.host, local.port, times_ms, **load_args))
+
+	def median(values: list[float]) -> float:
+		return sorted(values)[len(values) // 2]
+
+	print(f'{server} server, {mode} arrivals, {num_keys} keys, limit {limit:g} / s per key; latency at {reference_rps:g} rps, max rps at p99 <= {slo_ms:g} ms')
+	print(f'{"algorithm":>16} {"backend":>10} {"OK %":>6} {"p50 ms":>8} {"p99 ms":>8} {"added p99":>10} {"limiter us":>11} {"max rps":>9}')
+
+	with LocalServer(server) as baseline:
+		runs = [reference_run(baseline) for _ in range(repeats)]
+		best_rps = max_rps(baseline.host, baseline.port, mode, slo_ms=slo_ms, start_rps=reference_rps, **load_args)
+		p50 = median([percentile(run['latencies_ms'], 50) for run in runs])
+		p99 = median([percentile(run['latencies_ms'], 99) for run in runs])
+		print(f'{"(no limiter)":>16} {"-":>10} {100.0:6.1f} {p50:8.2f} {p99:8.2f} {"-":>10} {"-":>11} {best_rps:9,.0f}')
+
+		for algorithm in algorithms:
+			for backend in backends:
+				try:
+					limiter, close = make_limiter(algorithm, backend, limit)
+				except ValueError:  # unsupported combination
+					continue
+
+				try:
+					with LocalServer(server, limiter) as local:
+						runs = []
+						added = []
+						for _ in range(repeats):
+							baseline_p99 = percentile(reference_run(baseline)['latencies_ms'], 99)
+							runs.append(reference_run(local))
+							added.append(percentile(runs[-1]['latencies_ms'], 99) - baseline_p99)
+						limiter_us = percentile(sorted(local.take_timings()), 99) / 1000
+						best_rps = max_rps(local.host, local.port, mode, slo_ms=slo_ms, start_rps=reference_rps, **load_args)
+				finally:
+					close()
+
+				statuses = Counter()
+				for run in runs:
+					statuses.update(run['statuses'])
+				ok_percent = 100 * statuses[200] / max(sum(statuses.values()), 1)
+				p50 = median([percentile(run['latencies_ms'], 50) for run in runs])
+				p99 = median([percentile(run['latencies_ms'], 99) for run in runs])
+				print(f'{algorithm:>16} {backend:>10} {ok_percent:6.1f} {p50:8.2f} {p99:8.2f} {median(added):+10.2f} {limiter_us:11.1f} {best_rps:9,.0f}')
+
+if __name__ == "__main__":
+	server = sys.argv[1] if len(sys.argv) > 1 else 'asgi'
+	mode = sys.argv[2] if len(sys.argv) > 2 else 'uniform'
+	benchmark(server, mode)
@@ -1,7 +1,6 @@
 '''main experiment file used for  https://aryadee.dev/blog/rate-limiting-algorithms
 '''
 
-import rich.traceback; rich.traceback.install()
 from rich.pretty import pprint
 import random
 from plot import *
@@ -142,6 +141,7 @@ LIMIT = 5  # max # of requests allowed per window
 WINDOW_LENGTH_MS = 1000  # size of the time window in milliseconds
 
 if __name__ == "__main__":
+	import rich.traceback; rich.traceback.install()
 
 	dummy_time.change_times(RPS, DURATION, mode='uniform')
 	experiment_batch(
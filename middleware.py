@@ -0,0 +1,248 @@
+'''Rate limiting middleware for ASGI and WSGI apps, plus minimal local servers to run them.
+
+Both middlewares take any limiter as a callable from key to result: a policy's `allow`, a fast limiter's `allow`, or a `rate_limiters` function with its arguments bound.
+
+```python
+limiter = LeakyBucket(limit=5, window_length_ms=1000, mode='soft', clock=MonotonicClock())
+app = ASGIRateLimiter(app, limiter.allow)
+wsgi_app = WSGIRateLimiter(wsgi_app, partial(fixed_window, limit=5, window_length_ms=1000, cache=my_cache))
+```
+
+`"OK"` requests go through to the app, with the limiter result in `scope['rate_limit']` / `environ['rate_limit']`. `"DENIED"` requests get a `429 Too Many Requests`. `"DELAYED"` results from `shaping.py` are held for `wait_ms` and then go through.
+
+`WSGIRateLimiter` serializes limiter calls with a lock, since WSGI servers run requests on many threads. `ASGIRateLimiter` doesn't need one: the limiter call doesn't `await`, so it runs to completion on the event loop.
+
+The key defaults to the client IP; pass `key=` to use e.g. an API key header instead.
+
+`serve_asgi()` and `serve_wsgi()` are small standard library servers (asyncio with HTTP/1.1 keep-alive, and a threading `wsgiref` server) so the middleware can be run and load tested on one machine without installing anything. They're meant for local testing, not for production traffic; in production, use your usual server (uvicorn, gunicorn, ...) with the same middleware. `load_test.py` drives them over localhost.
+'''
+
+import time
+import threading
+from contextlib import nullcontext
+from http import HTTPStatus
+from typing import Callable
+
+_DENIED_BODY = b'Too Many Requests'
+
+def client_ip(scope: dict) -> str:
+	''' Default ASGI key: the client's IP address.
+	'''
+	client = scope.get('client')
+	return client[0] if client else ''
+
+def remote_addr(environ: dict) -> str:
+	''' Default WSGI key: the client's IP address.
+	'''
+	return environ.get('REMOTE_ADDR', '')
+
+class ASGIRateLimiter:
+	''' ASGI middleware that rate limits HTTP requests. Other scope types (lifespan, websocket) pass through untouched.
+	'''
+
+	def __init__(self, app: Callable, limiter: Callable[[str], dict], key: Callable[[dict], str] = None):
+		''' `app`: The ASGI app to protect.
+
+		`limiter`: Called with the key of each request; returns a rate limiter result.
+
+		`key`: Called with the ASGI scope; returns the key to rate limit on. Defaults to `client_ip`.
+		'''
+		self.app = app
+		self.limiter = limiter
+		self.key = key if key is not None else client_ip
+
+	async def __call__(self, scope: dict, receive: Callable, send: Callable):
+		if scope['type'] != 'http':
+			await self.app(scope, receive, send)
+			return
+
+		result = self.limiter(self.key(scope))
+		status = result['status']
+
+		if status == 'DENIED':
+			await send({
+				'type': 'http.response.start',
+				'status': 429,
+				'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(_DENIED_BODY)).encode())],
+			})
+			await send({'type': 'http.response.body', 'body': _DENIED_BODY})
+			return
+
+		if status == 'DELAYED':
+			import asyncio
+			await asyncio.sleep(result['wait_ms'] / 1000)
+
+		await self.app({**scope, 'rate_limit': result}, receive, send)
+
+class WSGIRateLimiter:
+	''' WSGI middleware that rate limits requests.
+
+	WSGI servers call apps from many threads, and the `DummyCache` limiters and policy classes aren't thread safe (a get-then-set can lose updates), so limiter calls are serialized with a lock by default. `"DELAYED"` requests wait outside the lock.
+	'''
+
+	def __init__(self, app: Callable, limiter: Callable[[str], dict], key: Callable[[dict], str] = None, lock: bool = True):
+		''' `app`: The WSGI app to protect.
+
+		`limiter`: Called with the key of each request; returns a rate limiter result.
+
+		`key`: Called with the WSGI environ; returns the key to rate limit on. Defaults to `remote_addr`.
+
+		`lock`: Serialize limiter calls. Pass `False` only for a limiter that is already thread safe, such as one backed by `SharedMemoryCache`.
+		'''
+		self.app = app
+		self.limiter = limiter
+		self.key = key if key is not None else remote_addr
+		self._lock = threading.Lock() if lock else nullcontext()
+
+	def __call__(self, environ: dict, start_response: Callable):
+		key = self.key(environ)
+		with self._lock:
+			result = self.limiter(key)
+		status = result['status']
+
+		if status == 'DENIED':
+			start_response('429 Too Many Requests', [('Content-Type', 'text/plain'), ('Content-Length', str(len(_DENIED_BODY)))])
+			return [_DENIED_BODY]
+
+		if status == 'DELAYED':  # blocks this worker thread
+			time.sleep(result['wait_ms'] / 1000)
+
+		environ['rate_limit'] = result
+		return self.app(environ, start_response)
+
+def _reason(status: int) -> bytes:
+	try:
+		return HTTPStatus(status).phrase.encode()
+	except ValueError:  # not a standard status
+		return b''
+
+async def _call_asgi(app: Callable, scope: dict, body: bytes) -> tuple[int, list, bytes]:
+	''' Runs `app` for one request. returns: The response status, headers and body.
+	'''
+	response = {'status': 500, 'headers': []}
+	chunks = []
+
+	async def receive() -> dict:
+		return {'type': 'http.request', 'body': body, 'more_body': False}
+
+	async def send(message: dict):
+		if message['type'] == 'http.response.start':
+			response['status'] = message['status']
+			response['headers'] = message.get('headers', [])
+		elif message['type'] == 'http.response.body':
+			chunks.append(message.get('body', b''))
+
+	await app(scope, receive, send)
+	return response['status'], response['headers'], b''.join(chunks)
+
+async def serve_asgi(app: Callable, host: str = '127.0.0.1', port: int = 8000, sock = None):
+	''' Serves an ASGI app over HTTP/1.1 with keep-alive until cancelled. Buffers whole requests and responses; no streaming, chunked bodies or lifespan events.
+
+	`sock`: An already listening socket to serve on instead of `host` / `port`, e.g. one shared by forked worker processes.
+	'''
+	import asyncio
+
+	async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		client = writer.get_extra_info('peername')
+		server = writer.get_extra_info('sockname')
+		try:
+			while True:
+				head = await reader.readuntil(b'\r\n\r\n')
+				request_line, *header_lines = head[:-4].split(b'\r\n')
+				method, target, version = request_line.split(b' ', 2)
+
+				headers = []
+				length = 0
+				keep_alive = version == b'HTTP/1.1'
+				for line in header_lines:
+					name, _, value = line.partition(b':')
+					name, value = name.strip().lower(), value.strip()
+					headers.append((name, value))
+					if name == b'content-length':
+						length = int(value)
+					elif name == b'connection':
+						keep_alive = value.lower() == b'keep-alive'
+				body = await reader.readexactly(length) if length else b''
+
+				path, _, query = target.partition(b'?')
+				scope = {
+					'type': 'http',
+					'asgi': {'version': '3.0'},
+					'http_version': version[5:].decode(),
+					'method': method.decode(),
+					'scheme': 'http',
+					'path': path.decode(),
+					'raw_path': path,
+					'query_string': query,
+					'root_path': '',
+					'headers': headers,
+					'client': client[:2] if client else None,
+					'server': server[:2] if server else None,
+				}
+				status, response_headers, response_body = await _call_asgi(app, scope, body)
+
+				lines = [b'HTTP/1.1 %d %s' % (status, _reason(status))]
+				lines.extend(name + b': ' + value for name, value in response_headers if name.lower() not in (b'content-length', b'connection'))
+				lines.append(b'content-length: %d' % len(response_body))
+				lines.append(b'connection: keep-alive' if keep_alive else b'connection: close')
+				writer.write(b'\r\n'.join(lines) + b'\r\n\r\n' + response_body)
+				await writer.drain()
+				if not keep_alive:
+					break
+		except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+			pass  # client went away, or sent something this server doesn't parse
+		finally:
+			writer.close()
+
+	if sock is not None:
+		server = await asyncio.start_server(handle, sock=sock)
+	else:
+		server = await asyncio.start_server(handle, host, port)
+	async with server:
+		await server.serve_forever()
+
+def serve_wsgi(app: Callable, host: str = '127.0.0.1', port: int = 8000, sock = None):
+	''' Serves a WSGI app with `wsgiref`, one thread per connection, until interrupted. `wsgiref` speaks HTTP/1.0, so each request gets a new connection.
+
+	`sock`: An already listening socket to serve on instead of `host` / `port`.
+	'''
+	from socketserver import ThreadingMixIn
+	from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+	class Handler(WSGIRequestHandler):
+		def log_message(self, *args):
+			pass  # no access log on the hot path
+
+	class Server(ThreadingMixIn, WSGIServer):
+		daemon_threads = True
+
+	if sock is None:
+		server = Server((host, port), Handler)
+	else:
+		server = Server(sock.getsockname()[:2], Handler, bind_and_activate=False)
+		server.socket.close()
+		server.socket = sock
+		server.server_name, server.server_port = sock.getsockname()[:2]  # what `server_bind()` would have set
+		server.setup_environ()
+
+	server.set_app(app)
+	with server:
+		server.serve_forever()
+
+if __name__ == "__main__":
+	import sys
+	import asyncio
+	from clocks import MonotonicClock
+	from policies import LeakyBucket
+
+	async def hello(scope, receive, send):
+		await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/plain')]})
+		await send({'type': 'http.response.body', 'body': f'hello {scope["client"][0]}: {scope["rate_limit"]}\n'.encode()})
+
+	port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+	limiter = LeakyBucket(limit=5, window_length_ms=1000, mode='soft', clock=MonotonicClock())
+	print(f'http://127.0.0.1:{port}/ allows 5 requests / s per client IP; try `curl` in a loop. Ctrl-C to stop.')
+	try:
+		asyncio.run(serve_asgi(ASGIRateLimiter(hello, limiter.allow), port=port))
+	except KeyboardInterrupt:
+		pass
@@ -3,14 +3,12 @@
 
 import sys
 import json
+import numpy as np
 import pandas as pd
-import rich.traceback
 from rich.pretty import pprint
 from plotly import graph_objects as go
 from plotly.subplots import make_subplots
 
-rich.traceback.install()  # prettier traceback
-
 MARGIN = dict(
 			t = 40,
 			b = 20,
@@ -18,63 +16,79 @@ MARGIN = dict(
 			r = 20
 		)
 
-def plot_fixed_window(data: dict, title_append=''):
-	"""Plot the fixed window data"""
+def add_windows(fig: go.Figure, window_starts, window_ends, line_width: float = 3, end_opacity: float = 0.7):
+	''' Adds a shaded span and start / end lines for every window.
 
+	All the shapes go in with one layout update. Calling `add_vrect()` / `add_vline()` per window re-validates every shape already on the figure, which is quadratic in the number of windows.
+	'''
+	shapes = []
+	for window_start, window_end in zip(window_starts, window_ends):
+		shapes += [
+			dict(type = "rect", xref = "x", yref = "y domain", x0 = window_start, x1 = window_end, y0 = 0, y1 = 1, fillcolor = "gray", opacity = 0.05, layer = "below", line_width = 0),
+			dict(type = "line", xref = "x", yref = "y domain", x0 = window_start, x1 = window_start, y0 = 0, y1 = 1, line = dict(width = line_width, color = "darkgreen", dash = "solid"), layer = "below", opacity = 0.5),
+			dict(type = "line", xref = "x", yref = "y domain", x0 = window_end, x1 = window_end, y0 = 0, y1 = 1, line = dict(width = line_width, color = "darkred", dash = "solid"), layer = "below", opacity = end_opacity),
+		]
+	fig.update_layout(shapes = list(fig.layout.shapes) + shapes)
+
+def window_index(df: pd.DataFrame, window_starts: np.ndarray) -> pd.Series:
+	''' returns: For each row, the index of the last window starting at or before it, or -1 before the first window.
+	'''
+	return pd.Series(np.searchsorted(window_starts, df['time'].to_numpy(), side = 'right') - 1, index = df.index)
 
-	df = pd.DataFrame(data['plot'])
-	fig = go.Figure()
+def last_oks(df: pd.DataFrame, window: pd.Series) -> pd.DataFrame:
+	''' returns: The last OK row of each window, indexed by window.
+	'''
+	oks = df[(df['status'] == 'OK') & (window >= 0)]
+	return oks.groupby(window[oks.index]).last()
 
-	df['time'] = df['time_ms'] / 1000  # convert to seconds
+def counter_steps(df: pd.DataFrame, window: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+	''' Builds the sawtooth counter trace of every window in one pass.
 
-	window_starts =  list(df[df['counter'] == 1]['time'])
-	window_ends = list(map(lambda x: x + data['window_length_ms'] / 1000, window_starts))
-
-	for idx, (window_start, window_end) in enumerate(zip(window_starts, window_ends)):
-		fig.add_vrect(
-		    x0 = window_start,
-		    x1 = window_end,
-		    fillcolor = "gray",
-		    opacity = 0.05,
-		    layer = "below",
-		    line_width = 0,
-		)
+	Each OK also appears one count lower at the same time, so the line steps up at every OK. Windows are separated by NaN points, which Plotly draws as gaps, so the whole thing is a single trace.
 
-		fig.add_vline(
-			x = window_start, 
-			line_width = 3, 
-			line_color = "darkgreen", 
-			layer = "below", 
-			opacity = 0.5, 
-			line_dash = "solid"
-		)
+	`window`: The window index of each row. Rows with a negative index aren't in any window and are left out.
 
-		fig.add_vline(
-		    x = window_end,
-		    line_width = 3,
-		    line_color = "darkred",
-		    layer = "below",
-		    opacity = 0.7,
-		    line_dash = "solid",
-		)
+	returns: x (time in s) and y (counter) arrays.
+	'''
+	in_window = window >= 0
+	rows = df.loc[in_window, ['time', 'counter']].assign(window = window[in_window])
+	lowered = rows[df.loc[in_window, 'status'] == 'OK']
+	lowered = lowered.assign(counter = lowered['counter'] - 1)
+	gaps = pd.DataFrame({'time': np.nan, 'counter': np.nan, 'window': rows['window'].unique()})
 
-		window_df = df[(df['time'] >= window_start) & (df['time'] < window_end) ]
-		# df_duplicated = window_df.assign(counter=window_df['counter'] - 1)
-		df_duplicated = window_df.copy()
-		df_duplicated.loc[df_duplicated['status'] == 'OK', 'counter'] -= 1
-		df_result = pd.concat([window_df, df_duplicated], ignore_index=True).sort_values(['time', 'counter'], ascending=[True, True])
+	trace = pd.concat([rows, lowered, gaps], ignore_index = True).sort_values(['window', 'time', 'counter'], na_position = 'last', kind = 'mergesort')
+	return trace['time'].to_numpy(), trace['counter'].to_numpy()
 
-		fig.add_trace(
+def add_counter_trace(fig: go.Figure, x: np.ndarray, y: np.ndarray):
+	fig.add_trace(
 		go.Scatter(
-			x=df_result['time'],
-			y=df_result['counter'],
-			name=f"counter #{idx}",
+			x = x,
+			y = y,
+			name = "counter",
 			mode = "lines",
 			line_color = "gainsboro",
 			opacity = 0.7
 		)
 	)
-		
+
+def plot_fixed_window(data: dict, title_append=''):
+	"""Plot the fixed window data"""
+
+
+	df = pd.DataFrame(data['plot'])
+	fig = go.Figure()
+
+	df['time'] = df['time_ms'] / 1000  # convert to seconds
+
+	# a window starts at each counter == 1 and lasts window_length_ms; requests after it ends and before the next one aren't in any window
+	window_starts = df.loc[df['counter'] == 1, 'time'].to_numpy()
+	window_ends = window_starts + data['window_length_ms'] / 1000
+	window = window_index(df, window_starts)
+	window = window.where(df['time'].to_numpy() < window_ends[window.clip(lower = 0)], -1)
+
+	add_windows(fig, window_starts, window_ends)
+	add_counter_trace(fig, *counter_steps(df, window))
+
 	# the limit line
 	fig.add_hline(
 	    y = data['limit'],
@@ -178,39 +192,8 @@ def plot_enforced_avg(data: dict, title_append=''):
 
 	# the windows
 	exclusion_window = 1 / data['limit_rps']
-	window_starts =  list(df[df['status'] == 'OK']['time'])
-	window_ends = list(map(lambda x: x + exclusion_window, window_starts))
-
-	for window_start, window_end in zip(window_starts, window_ends):
-		fig.add_vrect(
-		    x0 = window_start,
-		    x1 = window_end,
-		    fillcolor = "gray",
-		    opacity = 0.05,
-		    layer = "below",
-		    line_width = 0,
-		)
-
-		fig.add_vline(
-			x = window_start, 
-			line_width = 3, 
-			line_color = "darkgreen", 
-			layer = "below", 
-			opacity = 0.5, 
-			line_dash = "solid"
-		)
-
-		fig.add_vline(
-		    x = window_end,
-		    line_width = 3,
-		    line_color = "darkred",
-		    layer = "below",
-		    opacity = 0.7,
-		    line_dash = "solid",
-		)
-
-
-
+	window_starts = df.loc[df['status'] == 'OK', 'time'].to_numpy()
+	add_windows(fig, window_starts, window_starts + exclusion_window)
 
 	fig.add_hline(
 	    y = data['limit_rps'],
@@ -307,60 +290,13 @@ def plot_sliding_window(data: dict, title_append: str = ""):
 	    font = dict(color = "deeppink",)
 	)
 
-	window_starts =  df.loc[df['new'] == True, 'time'].tolist()
-	window_starts_inf = window_starts + [float('inf')] # dupe widnow_starts w/ inf at the end so we can iterate over pairs
-
-	for idx, window_start in enumerate(window_starts):
-		window_df = df[(df['time'] >= window_starts_inf[idx]) & (df['time'] < window_starts_inf[idx + 1])]
-		last_ok = window_df[window_df['status'] == 'OK'].tail(1)['time'].values[0]
-		window_end = last_ok + data['window_length_ms'] / 1000
-
-		fig.add_vrect(
-		    x0 = window_start,
-		    x1 = window_end,
-		    fillcolor = "gray",
-		    opacity = 0.05,
-		    layer = "below",
-		    line_width = 0,
-		)
-
-		fig.add_vline(
-			x = window_start, 
-			line_width = 2,
-			line_color = "darkgreen",
-			layer = "below",
-			opacity = 0.5,
-			line_dash = "solid"
-		)
-
-		fig.add_vline(
-		    x = window_end,
-		    line_width = 2,
-		    line_color = "darkred",
-		    layer = "below",
-		    opacity = 0.5,
-		    line_dash = "solid",
-		)
-
-		df_filtered = window_df.loc[df['status'] == 'OK']
-
-		# create new dataframe with incremented counter
-		df_duplicated = df_filtered.assign(counter=df_filtered['counter'] - 1)
-
-		# concatenate original dataframe with new dataframe
-		df_result = pd.concat([window_df, df_duplicated], ignore_index=True).sort_values(['time', 'counter'], ascending=[True, True])
-
-		fig.add_trace(
-			go.Scatter(
-				x=df_result['time'],
-				y=df_result['counter'],
-				name=f"counter #{idx}",
-				mode = "lines",
-				line_color = "gainsboro",
-				opacity = 0.7
-			)
-		)
+	# a window runs from each new entry until the entry expires, i.e. window_length_ms after its last OK
+	window_starts = df.loc[df['new'] == True, 'time'].to_numpy()
+	window = window_index(df, window_starts)
+	window_ends = last_oks(df, window)['time'].to_numpy() + data['window_length_ms'] / 1000
 
+	add_windows(fig, window_starts, window_ends, line_width = 2, end_opacity = 0.5)
+	add_counter_trace(fig, *counter_steps(df, window))
 
 	fig.update_layout(
 	    title_text = "sliding_window() " + title_append,
@@ -436,63 +372,15 @@ def plot_leaky_bucket(data: dict, title_append=''):
 	    font = dict(color = "deeppink",)
 	)
 
-	window_starts =  df.loc[df['new'] == True, 'time'].tolist()
-	window_starts_inf = window_starts + [float('inf')] # dupe widnow_starts w/ inf at the end so we can iterate over pairs
-
-	for idx, window_start in enumerate(window_starts):
-		window_df = df[(df['time'] >= window_starts_inf[idx]) & (df['time'] < window_starts_inf[idx + 1])]
-		last_ok = window_df[window_df['status'] == 'OK'].tail(1)['time'].values[0]
-
-		if data['mode'] == 'soft':
-			window_end = last_ok + (window_df[window_df['time'] == last_ok]['counter'].values[0] / data['limit']) * data['window_length_ms'] / 1000
-		else:
-			window_end = last_ok + (window_df[window_df['time'] == last_ok]['counter'].values[0]) * data['window_length_ms'] / 1000
-
-		fig.add_vrect(
-		    x0 = window_start,
-		    x1 = window_end,
-		    fillcolor = "gray",
-		    opacity = 0.05,
-		    layer = "below",
-		    line_width = 0,
-		)
-
-		fig.add_vline(
-			x = window_start, 
-			line_width = 2,
-			line_color = "darkgreen",
-			layer = "below",
-			opacity = 0.5,
-			line_dash = "solid"
-		)
-
-		fig.add_vline(
-		    x = window_end,
-		    line_width = 2,
-		    line_color = "darkred",
-		    layer = "below",
-		    opacity = 0.5,
-		    line_dash = "solid",
-		)
-
-		df_filtered = window_df.loc[df['status'] == 'OK']
+	# a window runs from each new entry until the bucket has drained after its last OK
+	window_starts = df.loc[df['new'] == True, 'time'].to_numpy()
+	window = window_index(df, window_starts)
+	last_ok = last_oks(df, window)
+	leak_rate = data['limit'] if data['mode'] == 'soft' else 1
+	window_ends = last_ok['time'].to_numpy() + (last_ok['counter'].to_numpy() / leak_rate) * data['window_length_ms'] / 1000
 
-		# create new dataframe with incremented counter
-		df_duplicated = df_filtered.assign(counter=df_filtered['counter'] - 1)
-
-		# concatenate original dataframe with new dataframe
-		df_result = pd.concat([window_df, df_duplicated], ignore_index=True).sort_values(['time', 'counter'], ascending=[True, True])
-
-		fig.add_trace(
-			go.Scatter(
-				x=df_result['time'],
-				y=df_result['counter'],
-				name=f"counter #{idx}",
-				mode = "lines",
-				line_color = "gainsboro",
-				opacity = 0.7
-			)
-		)
+	add_windows(fig, window_starts, window_ends, line_width = 2, end_opacity = 0.5)
+	add_counter_trace(fig, *counter_steps(df, window))
 
 	fig.update_layout(
 	    title_text = "leaky_bucket() " + title_append,
@@ -525,16 +413,11 @@ def get_num_oks(df, window_len_ms: float, fig):
 	df = pd.concat([df, new_rows], ignore_index=True).drop_duplicates(subset=['time_ms']).sort_values(['time_ms', 'status'], ascending=[True, True])
 
 
-	num_oks = []
-	for end_time in df['time_ms']:
-		start_time =  max(end_time - window_len_ms, 0)
-
-		mask = (df['time_ms'] > start_time) & (df['time_ms'] < end_time) | (df['time_ms'] == end_time) # all the times within the window
-
-		# get the number of OKs within the window
-		num_oks.append(df.loc[mask, 'status'].eq('OK').sum())
-
-	df['num_oks'] = num_oks
+	# OKs with max(end_time - window_len_ms, 0) < time <= end_time, for every end time at once, by binary search over the sorted OK times
+	ok_times = np.sort(df.loc[df['status'] == 'OK', 'time_ms'].to_numpy())
+	end_times = df['time_ms'].to_numpy()
+	start_times = np.maximum(end_times - window_len_ms, 0)
+	df['num_oks'] = np.searchsorted(ok_times, end_times, side = 'right') - np.searchsorted(ok_times, start_times, side = 'right')
 
 	fig.add_trace(
 		go.Scatter(
@@ -558,6 +441,7 @@ def figs_to_subplot(figs: list[go.Figure], title: str, duration:float, **kwargs)
 		**kwargs
 	)
 
+	shapes = []
 	for i, fig in enumerate(figs):
 
 		for trace in fig.data:
@@ -565,8 +449,17 @@ def figs_to_subplot(figs: list[go.Figure], title: str, duration:float, **kwargs)
 				trace.legendgroup = kwargs['subplot_titles'][i]
 				trace.legendgrouptitle.text = kwargs['subplot_titles'][i]
 			subplot.add_trace(trace, row=i+1, col=1)
+
+		# move the shapes onto this row's axes ('x' -> 'x2', 'y domain' -> 'y2 domain', ...) and add them all at the end, in one update
+		suffix = '' if i == 0 else str(i + 1)
 		for shape in fig.layout.shapes:
-			subplot.add_shape(shape, row=i+1, col=1)
+			shape = shape.to_plotly_json()
+			for ref in ('xref', 'yref'):
+				axis, _, domain = shape[ref].partition(' ')
+				if axis in ('x', 'y'):  # leave 'paper' alone
+					shape[ref] = f'{axis}{suffix} {domain}'.strip()
+			shapes.append(shape)
+	subplot.update_layout(shapes = list(subplot.layout.shapes) + shapes)
 		# for annotation in fig.layout.annotations:
 		# 	subplot.add_annotation(annotation, row=i+1, col=1)
 
@@ -588,6 +481,8 @@ def debugger_is_active() -> bool:
 	return hasattr(sys, 'gettrace') and sys.gettrace() is not None
 
 if __name__ == "__main__":
+	import rich.traceback
+	rich.traceback.install()  # prettier traceback
 
 	if debugger_is_active():
 		file_path = "./data/fixed_window.json"
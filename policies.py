@@ -0,0 +1,217 @@
+'''Object-oriented rate limiters. Same algorithms and results as `rate_limiters.py`, but each policy validates and precomputes its parameters once and binds its cache and clock, so the per-request `allow(key)` does only the per-request work.
+
+```python
+limiter = LeakyBucket(limit=5, window_length_ms=1000, mode='soft', cache=my_cache, clock=MonotonicClock())
+
+if limiter.allow(request_ip)['status'] == 'OK':
+	...
+```
+
+`cache` is anything with `get()`, `set()` and `incr()` like `DummyCache` or `SharedMemoryCache`; subclass `Cache` for your own data store. Run `python policies.py` for micro-benchmarks against the functional calls.
+'''
+
+from abc import ABC, abstractmethod
+from typing import Any
+
+from clocks import Clock, MonotonicClock
+
+class Cache(ABC):
+	''' Template class for the data store. Implement it for your DB access and pass an instance to any policy.
+	'''
+
+	@abstractmethod
+	def get(self, key: str) -> Any:
+		''' returns: The value for `key`, or None if it doesn't exist or has expired.
+		'''
+
+	@abstractmethod
+	def set(self, key: str, value: Any, ttl: float = None):
+		''' Sets `key` to `value`, expiring after `ttl` milliseconds.
+		'''
+
+	@abstractmethod
+	def incr(self, key: str):
+		''' Increments an integer value. Must not reset the TTL (just like in Redis).
+		'''
+
+class RateLimiter(ABC):
+	''' Base class for the policies. Binds the cache and clock.
+	'''
+
+	def __init__(self, cache: Cache = None, clock: Clock = None):
+		''' `cache`: The data store. Defaults to a new in-process `DummyCache` using `clock`.
+
+		`clock`: Millisecond clock. Must be the clock `cache` uses for TTLs. Defaults to the cache's `clock`, or `MonotonicClock` if it has none.
+		'''
+		if clock is None:
+			clock = getattr(cache, 'clock', None)
+		self.clock = clock if clock is not None else MonotonicClock()
+		if cache is None:
+			from dummy_cache import DummyCache
+			cache = DummyCache(clock=self.clock)
+		self.cache = cache
+
+	@abstractmethod
+	def allow(self, key: str) -> dict:
+		''' Rate limits one request for `key`.
+
+		returns: The same dictionary as the matching function in `rate_limiters.py`.
+		'''
+
+def _check_positive(name: str, value: float):
+	if not value > 0:
+		raise ValueError(f'Invalid {name}: {value}')
+
+class FixedWindow(RateLimiter):
+	''' See `rate_limiters.fixed_window`.
+	'''
+
+	def __init__(self, limit: float, window_length_ms: float = 1000, cache: Cache = None, clock: Clock = None):
+		_check_positive('limit', limit)
+		_check_positive('window_length_ms', window_length_ms)
+		super().__init__(cache, clock)
+		self.limit = limit
+		self.window_length_ms = window_length_ms
+
+	def allow(self, key: str) -> dict:
+		cache = self.cache
+		counter = cache.get(key)
+
+		if counter is not None:
+			if counter < self.limit:
+				cache.incr(key)
+				return {"status": "OK", "counter": counter + 1}
+			return {"status": "DENIED", "counter": counter}
+
+		cache.set(key, 1, self.window_length_ms)
+		return {"status": "OK", "counter": 1}
+
+class EnforcedAvg(RateLimiter):
+	''' See `rate_limiters.enforced_avg`.
+	'''
+
+	def __init__(self, limit_rps: float, cache: Cache = None, clock: Clock = None):
+		_check_positive('limit_rps', limit_rps)
+		super().__init__(cache, clock)
+		self.limit_rps = limit_rps
+		self.exclusion_window = 1000 / limit_rps
+
+	def allow(self, key: str) -> dict:
+		cache = self.cache
+		if cache.get(key) is not None:
+			return {"status": "DENIED"}
+
+		cache.set(key, 1, self.exclusion_window)
+		return {"status": "OK"}
+
+class SlidingWindow(RateLimiter):
+	''' See `rate_limiters.sliding_window`.
+	'''
+
+	def __init__(self, limit: float, window_length_ms: float = 1000, cache: Cache = None, clock: Clock = None):
+		_check_positive('limit', limit)
+		_check_positive('window_length_ms', window_length_ms)
+		super().__init__(cache, clock)
+		self.limit = limit
+		self.window_length_ms = window_length_ms
+
+	def allow(self, key: str) -> dict:
+		now = self.clock.now()
+		cache = self.cache
+		window_length_ms = self.window_length_ms
+		times: list = cache.get(key)
+
+		if times is not None:
+			times = [time for time in times if now - time < window_length_ms]
+
+			if len(times) < self.limit:
+				times.append(now)
+				cache.set(key, times, window_length_ms)
+				return {"status": "OK", "counter": len(times), "new": False}
+			return {"status": "DENIED", "counter": len(times), "new": False}
+
+		cache.set(key, [now], window_length_ms)
+		return {"status": "OK", "counter": 1, "new": True}
+
+class LeakyBucket(RateLimiter):
+	''' See `rate_limiters.leaky_bucket`.
+	'''
+
+	def __init__(self, limit: float, window_length_ms: float = 1000, mode: str = 'soft', cache: Cache = None, clock: Clock = None):
+		_check_positive('limit', limit)
+		_check_positive('window_length_ms', window_length_ms)
+
+		if mode == 'soft':
+			leak_rate = limit  # leak at limit-many requests per window
+		elif mode == 'hard':
+			leak_rate = 1  # leak at 1 request per window
+		else:
+			raise ValueError(f'Invalid mode: {mode}')
+
+		super().__init__(cache, clock)
+		self.limit = limit
+		self.window_length_ms = window_length_ms
+		self.mode = mode
+		self.leak_rate = leak_rate
+		self.new_ttl = window_length_ms / leak_rate
+
+	def allow(self, key: str) -> dict:
+		now = self.clock.now()
+		cache = self.cache
+		entry: dict = cache.get(key)
+
+		if entry is not None:
+			# same expression order as `leaky_bucket()` so the floats match bit for bit
+			counter = max(entry['counter'] - ((now - entry['time']) * self.leak_rate) / self.window_length_ms, 0)
+
+			if counter + 1 < self.limit:
+				cache.set(key, {'counter': counter + 1, 'time': now}, (counter + 1) * self.window_length_ms / self.leak_rate)
+				return {"status": "OK", "counter": counter + 1, "new": False}
+			return {"status": "DENIED", "counter": counter, "new": False}
+
+		cache.set(key, {'counter': 1, 'time': now}, self.new_ttl)
+		return {"status": "OK", "counter": 1, "new": True}
+
+def benchmark(num_requests: int = 100_000, num_keys: int = 1000, repeats: int = 5):
+	''' Prints ns / decision for each functional limiter and its policy class, and checks the results match.
+	'''
+	import time
+	import random
+	from functools import partial
+	from clocks import ManualClock
+	from dummy_cache import DummyCache
+	from rate_limiters import fixed_window, enforced_avg, sliding_window, leaky_bucket
+
+	random.seed(0)
+	keys = [f'10.0.{i // 256}.{i % 256}' for i in range(num_keys)]
+	workload = [random.choice(keys) for _ in range(num_requests)]
+	times = [i * 0.5 for i in range(num_requests)]
+	clock = ManualClock()
+	cache = DummyCache(clock=clock)
+
+	def run(decide) -> tuple[float, list]:
+		best = float('inf')
+		for _ in range(repeats):
+			cache.reset()
+			results = [None] * num_requests
+			start = time.perf_counter_ns()
+			for idx, key in enumerate(workload):
+				clock.time_ms = times[idx]
+				results[idx] = decide(key)
+			best = min(best, (time.perf_counter_ns() - start) / num_requests)
+		return best, results
+
+	for name, function, policy in [
+		('fixed_window', partial(fixed_window, limit=5, window_length_ms=1000, cache=cache), FixedWindow(5, 1000, cache, clock)),
+		('enforced_avg', partial(enforced_avg, limit_rps=5, cache=cache), EnforcedAvg(5, cache, clock)),
+		('sliding_window', partial(sliding_window, limit=5, window_length_ms=1000, clock=clock, cache=cache), SlidingWindow(5, 1000, cache, clock)),
+		('leaky_bucket soft', partial(leaky_bucket, limit=5, window_length_ms=1000, mode='soft', clock=clock, cache=cache), LeakyBucket(5, 1000, 'soft', cache, clock)),
+		('leaky_bucket hard', partial(leaky_bucket, limit=5, window_length_ms=1000, mode='hard', clock=clock, cache=cache), LeakyBucket(5, 1000, 'hard', cache, clock)),
+	]:
+		function_ns, expected = run(function)
+		policy_ns, got = run(policy.allow)
+		match = 'identical' if got == expected else 'MISMATCH'
+		print(f'{name:>18}: function {function_ns:6.0f} ns, policy {policy_ns:6.0f} ns ({(policy_ns / function_ns - 1) * 100:+5.1f} %, {match})')
+
+if __name__ == "__main__":
+	benchmark()
@@ -7,12 +7,22 @@
 # You may remove this comment block, but you may want to leave link to blog post above.
 #-------------------------------------------------------------------------------------
 
-from experiment_globals import dummy_cache, dummy_time
 from typing import Literal
 from dataclasses import dataclass
+from clocks import Clock
 
-# cache = experiment_globals.cache
-# datetime = experiment_globals.datetime
+# Importing this module has no side effects and needs only the standard library. The experiments'
+# shared `DummyCache` / `DummyTime` are only imported when a limiter is called without a `cache` / `clock`.
+
+def _experiment_globals():
+	import experiment_globals
+	return experiment_globals
+
+def _clock_of(cache) -> Clock:
+	''' Default `clock` for `sliding_window` / `leaky_bucket`: the clock `cache` uses for TTLs, so the stored timestamps and the TTLs come from the same clock. The experiments' `dummy_time` if the cache has none.
+	'''
+	clock = getattr(cache, 'clock', None)
+	return clock if clock is not None else _experiment_globals().dummy_time
 
 # these dataclasses weren't used because of clarity in blog post
 # but I encourage you to use them in your own code
@@ -38,7 +48,7 @@ class LeakyBucketReturn:
 	counter: int
 	new: bool
 
-def fixed_window(key: str, limit: float, window_length_ms: float = 1000) -> dict:
+def fixed_window(key: str, limit: float, window_length_ms: float = 1000, cache = None) -> dict:
 	'''Rate limits requests for target using fixed window.
     
     Fixed window is a simple rate limiting algorithm that allows a certain number of requests per time window. The window does **not** slide. Window starts when the first request is made. Relies on TTL for target cache entry to reset the window.
@@ -49,56 +59,71 @@ def fixed_window(key: str, limit: float, window_length_ms: float = 1000) -> dict
     
     `window_length_ms`: The size of the time window in milliseconds.
     
+    `cache`: The data store holding the counters. Anything with `get()`, `set()` and `incr()` like `DummyCache`. Defaults to the experiments' shared `DummyCache`.
+    
     returns: A dictionary containing `status` "OK" or "DENIED"; `counter` is the number of requests made in the current window; if 0 then the target did not exist in the cache (i.e. first request).
     '''
+	if cache is None:
+		cache = _experiment_globals().dummy_cache
 
-	counter = dummy_cache.get(key)
+	counter = cache.get(key)
 
 	if counter is not None:  # target cache entry exists
 		# cache.incr(key)  # incr() does not reset ttl (just like in Redis)
 
 		if counter < limit:
-			dummy_cache.incr(key)  # incr() does not reset ttl (just like in Redis)
+			cache.incr(key)  # incr() does not reset ttl (just like in Redis)
 			return {"status": "OK", "counter": counter + 1}
 		else:  # we hit limit
 			return {"status": "DENIED", "counter": counter}
 
 	else:  # target cache entry does not exist
-		dummy_cache.set(key, 1, window_length_ms)  # set the target cache entry with ttl
+		cache.set(key, 1, window_length_ms)  # set the target cache entry with ttl
 		return {"status": "OK", "counter": 1}  # should this be 1?
 
-def enforced_avg(key: str, limit_rps: float):
+def enforced_avg(key: str, limit_rps: float, cache = None):
 	'''Rate limits requests for target using exclusion window. Could also be described as enforced average'''
+	if cache is None:
+		cache = _experiment_globals().dummy_cache
 	exclusion_window = 1000 / limit_rps
 
-	cache_target = dummy_cache.get(key)
+	cache_target = cache.get(key)
 
 	if cache_target is not None:  # target cache entry exists
 		return {"status": "DENIED"}
 	else:  # target cache entry does not exist
-		dummy_cache.set(key, 1, exclusion_window)  # set the target cache entry with ttl
+		cache.set(key, 1, exclusion_window)  # set the target cache entry with ttl
 		return {"status": "OK"}
 
-def sliding_window(key: str, limit: float, window_length_ms: float = 1000):
+def sliding_window(key: str, limit: float, window_length_ms: float = 1000, clock: Clock = None, cache = None):
+	if cache is None:
+		cache = _experiment_globals().dummy_cache
+	if clock is None:
+		clock = _clock_of(cache)
 
-	times: list = dummy_cache.get(key)
+	now = clock.now()  # read the clock once per decision
+	times: list = cache.get(key)
 	if times is not None:  # cache entry exists
 
 		# remove all times that are outside the window
-		times = [time for time in times if dummy_time.now() - time < window_length_ms]
+		times = [time for time in times if now - time < window_length_ms]
 
 		if len(times) < limit:
-			times.append(dummy_time.now())
-			dummy_cache.set(key, times, window_length_ms)
+			times.append(now)
+			cache.set(key, times, window_length_ms)
 			return {"status": "OK", "counter": len(times), "new": False}
 		else:
 			return {"status": "DENIED", "counter": len(times), "new": False}
 
 	else:
-		dummy_cache.set(key, [dummy_time.now()], window_length_ms)
+		cache.set(key, [now], window_length_ms)
 		return {"status": "OK", "counter": 1, "new": True}
 
-def leaky_bucket(key: str, limit: float, window_length_ms: float = 1000, mode = 'soft') -> dict:
+def leaky_bucket(key: str, limit: float, window_length_ms: float = 1000, mode = 'soft', clock: Clock = None, cache = None) -> dict:
+	if cache is None:
+		cache = _experiment_globals().dummy_cache
+	if clock is None:
+		clock = _clock_of(cache)
 
 	if mode == 'soft':
 		leak_rate = limit # leak at limit-many requests per window
@@ -107,7 +132,8 @@ def leaky_bucket(key: str, limit: float, window_length_ms: float = 1000, mode =
 	else:
 		raise ValueError(f'Invalid mode: {mode}')
 
-	entry: dict = dummy_cache.get(key)
+	now = clock.now()  # read the clock once per decision
+	entry: dict = cache.get(key)
 
 	if entry is not None:  # cache entry exists
 
@@ -115,15 +141,15 @@ def leaky_bucket(key: str, limit: float, window_length_ms: float = 1000, mode =
 		counter = entry['counter']
 		time = entry['time']
 
-		delta_time_ms = (dummy_time.now() - time)  # time since last request
+		delta_time_ms = (now - time)  # time since last request
 		counter = max(counter - (delta_time_ms * leak_rate) / window_length_ms, 0) # get the extrapolated counter value
 
 		if counter + 1 < limit:  # increment the counter
-			dummy_cache.set(
+			cache.set(
 				key, {
 					'counter': counter + 1,
-					'time': dummy_time.now()
-				}, (counter + 1) * 1000 / leak_rate
+					'time': now
+				}, (counter + 1) * window_length_ms / leak_rate  # time for the bucket to drain
 			)
 			
 			# set the target cache entry with ttl
@@ -132,10 +158,10 @@ def leaky_bucket(key: str, limit: float, window_length_ms: float = 1000, mode =
 			return {"status": "DENIED", "counter": counter, "new": False}
 
 	else:  # cache entry does not exist
-		dummy_cache.set(
+		cache.set(
 			key, {
 				'counter': 1,
-				'time': dummy_time.now()
+				'time': now
 			}, window_length_ms / leak_rate
 		)  # set the target cache entry with ttl
 		return {"status": "OK", "counter": 1, "new": True}
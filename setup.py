@@ -0,0 +1,24 @@
+'''Builds the optional compiled fast path used by `fast_limiters.py`:
+
+```bash
+python setup.py build_ext --inplace
+```
+
+Everything works without it; `fast_limiters.py` falls back to pure Python.
+
+This only builds the extension next to the sources. It doesn't install the limiters: they're flat modules with generic names (`clocks`, `policies`, ...) meant to be copied into a project, not put on `sys.path` as top-level modules. The plots and experiments need `pip install -r requirements.txt`.
+'''
+
+from setuptools import setup, Extension
+
+setup(
+	name = 'rate-limiting-algorithms',
+	ext_modules = [
+		Extension(
+			'_fastlimit',
+			sources = ['_fastlimit.c'],
+			extra_compile_args = ['-O2', '-ffp-contract=off'],  # no FMA, so floats match the Python limiters bit for bit
+			optional = True,  # without a C compiler, the build warns and skips it
+		)
+	],
+)
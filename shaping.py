@@ -0,0 +1,232 @@
+'''Traffic shaping: delay requests until they would be admitted, instead of denying them.
+
+Meant for internal batch clients that would otherwise retry in a loop. A shaped limiter reserves the earliest time the request fits, so the caller only has to wait for it, and denies only once `max_queue` requests are already waiting for `key`.
+
+- `shape_leaky_bucket(...)`: `leaky_bucket` that queues while the bucket is full. Delayed requests leave the bucket at its leak rate.
+- `shape_enforced_avg(...)`: `enforced_avg` that queues requests one exclusion window apart.
+- `Shaper`: awaits the reserved times in asyncio. All waiters share one timer heap and one event-loop timer, so many thousands of waiting requests cost a heap entry each.
+
+Results are `{"status": "OK" or "DELAYED" or "DENIED", "at": ..., "wait_ms": ...}`, where `at` is the admitted time in milliseconds. `"OK"` and a state with no reservations behave exactly like the unshaped limiter; `"DENIED"` leaves the state untouched.
+
+```python
+shaper = Shaper(partial(shape_leaky_bucket, limit=10, window_length_ms=1000, max_queue=100, clock=clock, cache=cache), clock)
+
+async def request_handler(request_ip: str):
+	if (await shaper.wait(request_ip))['status'] != 'DENIED':
+		...  # call upstream
+```
+
+Run `python shaping.py` to compare shaping with client retries, and to time many async waiters.
+'''
+
+import math
+import heapq
+import itertools
+from typing import Callable
+
+from clocks import Clock, MonotonicClock
+
+def _defaults(clock: Clock, cache) -> tuple:
+	''' Same fallbacks as `rate_limiters.py`: the experiments' `dummy_cache`, and the cache's own clock (`dummy_time` if it has none).
+	'''
+	if cache is None:
+		import experiment_globals
+		cache = experiment_globals.dummy_cache
+	if clock is None:
+		clock = getattr(cache, 'clock', None)
+		if clock is None:
+			import experiment_globals
+			clock = experiment_globals.dummy_time
+	return clock, cache
+
+def shape_leaky_bucket(key: str, limit: float, window_length_ms: float = 1000, mode = 'soft', max_queue: int = 0, clock: Clock = None, cache = None) -> dict:
+	''' `leaky_bucket` with a queue.
+
+	A request that doesn't fit is still added to the bucket, so the bucket level counts waiting requests too. It's admitted once the bucket has leaked down to `limit - 1`. One arriving at exactly `limit - 1` has nothing to wait for and is `"OK"` (unless `max_queue` is `0`, where it's denied like in `leaky_bucket`).
+
+	`max_queue`: Most requests waiting per key. `0` never delays, like `leaky_bucket`.
+
+	returns: `status`, `at` and `wait_ms` as in the module docstring, and `counter`, the bucket level including this request.
+	'''
+	if mode == 'soft':
+		leak_rate = limit  # leak at limit-many requests per window
+	elif mode == 'hard':
+		leak_rate = 1  # leak at 1 request per window
+	else:
+		raise ValueError(f'Invalid mode: {mode}')
+
+	clock, cache = _defaults(clock, cache)
+	now = clock.now()
+	entry: dict = cache.get(key)
+
+	if entry is None:
+		cache.set(key, {'counter': 1, 'time': now}, window_length_ms / leak_rate)
+		return {"status": "OK", "at": now, "wait_ms": 0.0, "counter": 1}
+
+	# same expression order as `leaky_bucket()` so unqueued decisions match bit for bit
+	counter = max(entry['counter'] - ((now - entry['time']) * leak_rate) / window_length_ms, 0)
+
+	if counter + 1 < limit:
+		cache.set(key, {'counter': counter + 1, 'time': now}, (counter + 1) * window_length_ms / leak_rate)
+		return {"status": "OK", "at": now, "wait_ms": 0.0, "counter": counter + 1}
+
+	# requests still waiting: the ones before this one sit at levels `counter - 1`, `counter - 2`, ..., and wait while that's above `limit - 1`
+	queued = max(math.ceil(counter - (limit - 1) - 1e-9) - 1, 0)  # tolerance for the leak arithmetic's rounding
+	if queued >= max_queue:
+		return {"status": "DENIED", "at": None, "wait_ms": None, "counter": counter}
+
+	wait_ms = (counter - (limit - 1)) * window_length_ms / leak_rate  # until the bucket has leaked to `limit - 1`
+	cache.set(key, {'counter': counter + 1, 'time': now}, (counter + 1) * window_length_ms / leak_rate)
+	if wait_ms <= 0:  # exactly at `limit - 1`: admitted now
+		return {"status": "OK", "at": now, "wait_ms": 0.0, "counter": counter + 1}
+	return {"status": "DELAYED", "at": now + wait_ms, "wait_ms": wait_ms, "counter": counter + 1}
+
+def shape_enforced_avg(key: str, limit_rps: float, max_queue: int = 0, clock: Clock = None, cache = None) -> dict:
+	''' `enforced_avg` with a queue. Admitted requests are at least one exclusion window (`1000 / limit_rps`) apart.
+
+	The cache holds the current run of back-to-back reservations, as `{'counter': reservations, 'time': first reservation}`, and expires when the next request may go. The queue length is counted from the time since the run started, not from the next free time: an absolute timestamp, like a `MonotonicClock` reading, is too large to divide into exclusion windows without rounding off a whole request.
+
+	`max_queue`: Most requests waiting per key. `0` never delays, like `enforced_avg`.
+	'''
+	exclusion_window = 1000 / limit_rps
+	clock, cache = _defaults(clock, cache)
+	now = clock.now()
+	entry: dict = cache.get(key)
+
+	if entry is None:
+		cache.set(key, {'counter': 1, 'time': now}, exclusion_window)
+		return {"status": "OK", "at": now, "wait_ms": 0.0}
+
+	start, reserved = entry['time'], int(entry['counter'])
+	gone = math.floor((now - start) / exclusion_window + 1e-9) + 1  # reservations whose time has come, the first one included
+	queued = max(reserved - gone, 0)  # requests already waiting
+	if queued >= max_queue:
+		return {"status": "DENIED", "at": None, "wait_ms": None}
+
+	free_at = start + reserved * exclusion_window
+	wait_ms = free_at - now
+	cache.set(key, {'counter': reserved + 1, 'time': start}, wait_ms + exclusion_window)
+	return {"status": "DELAYED", "at": free_at, "wait_ms": wait_ms}
+
+class Shaper:
+	''' Awaits shaped decisions on an asyncio event loop.
+
+	Waiters go in one heap ordered by admission time. A single `call_later` timer is kept for the earliest one; when it fires, every waiter that's due is woken in order.
+	'''
+
+	def __init__(self, shape: Callable, clock: Clock = None):
+		''' `shape`: Takes a key and returns a shaped result, e.g. `partial(shape_leaky_bucket, limit=..., clock=clock, cache=cache)`.
+
+		`clock`: The clock `shape` uses. Must run in real time; defaults to `MonotonicClock`.
+		'''
+		self.shape = shape
+		self.clock = clock if clock is not None else MonotonicClock()
+		self._heap = []  # (at, sequence, future)
+		self._sequence = itertools.count()  # ties keep arrival order
+		self._timer = None
+		self._timer_at = math.inf
+
+	async def wait(self, key: str) -> dict:
+		''' Shapes one request for `key` and, if it's delayed, waits until its admitted time.
+
+		A cancelled waiter's reservation is not handed back; the slot goes unused.
+
+		returns: The shaped result.
+		'''
+		result = self.shape(key)
+		if result['status'] != 'DELAYED':
+			return result
+
+		import asyncio  # imported on first use, like in `concurrency.py`
+
+		future = asyncio.get_running_loop().create_future()
+		heapq.heappush(self._heap, (result['at'], next(self._sequence), future))
+		if result['at'] < self._timer_at:
+			self._schedule()
+		await future
+		return result
+
+	def __len__(self):
+		''' Number of waiters, including cancelled ones not yet due.
+		'''
+		return len(self._heap)
+
+	def _schedule(self):
+		import asyncio
+
+		if self._timer is not None:
+			self._timer.cancel()
+		self._timer = None
+		self._timer_at = math.inf
+		if self._heap:
+			self._timer_at = self._heap[0][0]
+			self._timer = asyncio.get_running_loop().call_later(max(self._timer_at - self.clock.now(), 0) / 1000, self._fire)
+
+	def _fire(self):
+		now = self.clock.now()
+		heap = self._heap
+		while heap and heap[0][0] <= now:
+			future = heapq.heappop(heap)[2]
+			if not future.done():
+				future.set_result(None)
+		self._timer = None
+		self._schedule()
+
+if __name__ == "__main__":
+	import time
+	import asyncio
+	from functools import partial
+	from clocks import ManualClock
+	from dummy_cache import DummyCache
+	from rate_limiters import leaky_bucket
+
+	# batch client: 200 requests in a burst at t = 0, limit 10 per second. Denied requests are retried every 100 ms.
+	LIMIT = 10
+	BATCH = 200
+	RETRY_MS = 100
+
+	clock = ManualClock()
+	cache = DummyCache(clock=clock)
+
+	def retry_loop() -> tuple[float, int]:
+		pending = list(range(BATCH))
+		calls = 0
+		time_ms = 0.0
+		while pending:
+			clock.set(time_ms)
+			still_pending = []
+			for request in pending:
+				calls += 1
+				if leaky_bucket('batch', LIMIT, 1000, 'soft', clock=clock, cache=cache)['status'] != 'OK':
+					still_pending.append(request)
+			pending = still_pending
+			time_ms += RETRY_MS
+		return time_ms - RETRY_MS, calls
+
+	cache.reset()
+	done_ms, calls = retry_loop()
+	print(f'retries every {RETRY_MS} ms: {BATCH} requests done after {done_ms / 1000:.1f} s, {calls} limiter calls')
+
+	cache.reset()
+	clock.set(0.0)
+	results = [shape_leaky_bucket('batch', LIMIT, 1000, 'soft', max_queue=BATCH, clock=clock, cache=cache) for _ in range(BATCH)]
+	print(f'shaped:             {BATCH} requests done after {max(result["at"] for result in results) / 1000:.1f} s, {BATCH} limiter calls')
+
+	# many async waiters on one timer heap
+	WAITERS = 20_000
+	RATE = 10_000  # per second
+
+	async def many_waiters():
+		clock = MonotonicClock()
+		shaper = Shaper(partial(shape_enforced_avg, limit_rps=RATE, max_queue=WAITERS, clock=clock, cache=DummyCache(clock=clock)), clock)
+
+		async def request():
+			result = await shaper.wait('batch')
+			return clock.now() - (result['at'] if result['at'] is not None else clock.now())
+
+		start = time.perf_counter()
+		lateness = sorted(await asyncio.gather(*(request() for _ in range(WAITERS))))
+		elapsed = time.perf_counter() - start
+		print(f'\n{WAITERS} async waiters at {RATE} rps: done in {elapsed:.2f} s (ideal {WAITERS / RATE:.2f} s), lateness p50 {lateness[WAITERS // 2]:.2f} ms, p99 {lateness[WAITERS * 99 // 100]:.2f} ms')
+
+	asyncio.run(many_waiters())
@@ -0,0 +1,292 @@
+'''Shared-memory data store for rate limiters running in forked workers (e.g. gunicorn / uWSGI).
+
+Each worker with its own `DummyCache` multiplies the effective limit by the number of workers. `SharedMemoryCache` is a fixed-size open-addressing hash table in `multiprocessing.shared_memory`, so every worker forked after it's created sees the same counters. No external service is needed.
+
+The table is split into stripes. A key only ever probes slots inside its own stripe, and each stripe has its own lock, so workers touching different stripes never wait on each other.
+
+Expired entries are removed with backward-shift deletion: the rest of their probe run moves back to fill the gap, so there are no tombstones and a miss stops at the end of its run however many distinct keys the table has seen.
+
+Supports the values stored by `fixed_window`, `enforced_avg` and `leaky_bucket`. `sliding_window` stores a list per key and can't fit a fixed-size slot.
+'''
+
+import math
+import struct
+import functools
+import zlib
+from typing import Any, Callable
+
+from clocks import Clock, MonotonicClock
+
+# slot layout: state, kind, key length, padding, home (probe start within the stripe), a, b, expiration, key
+_SLOT = struct.Struct('<BBBxIddd64s')
+_HOME = struct.Struct('<I')  # at offset 4
+SLOT_SIZE = _SLOT.size
+MAX_KEY_BYTES = 64
+
+_EMPTY = 0
+_USED = 1
+
+_KIND_INT = 0  # `fixed_window` counter, `enforced_avg` flag; stored in `a`
+_KIND_BUCKET = 1  # `leaky_bucket` entry; `a` is the counter, `b` is the time
+
+_NO_EXPIRATION = math.inf
+
+@functools.lru_cache(maxsize=None)
+def _takes_clock(rate_limiter: Callable) -> bool:
+	import inspect
+	return 'clock' in inspect.signature(rate_limiter).parameters
+
+class SharedMemoryCache:
+	''' A `DummyCache`-compatible data store shared by forked processes.
+	'''
+
+	def __init__(self, capacity: int = 65536, stripes: int = 64, clock: Clock = None):
+		''' Creates the shared table. Create it in the parent process **before** forking workers.
+
+		`capacity`: Number of slots. Rounded up to a multiple of `stripes`. Keep the load well under 1, e.g. 2x the number of keys you expect within a window.
+
+		`stripes`: Number of independently locked stripes.
+
+		`clock`: The clock used for TTLs. Must be the same across processes; `MonotonicClock` (the default) is system-wide.
+		'''
+		import multiprocessing as mp  # imported here so importing this module stays cheap
+		from multiprocessing import shared_memory
+
+		self.stripes = stripes
+		self.stripe_size = max(1, -(-capacity // stripes))
+		self.capacity = self.stripe_size * stripes
+		self.clock = clock if clock is not None else MonotonicClock()
+		self._shm = shared_memory.SharedMemory(create=True, size=self.capacity * SLOT_SIZE)
+		self._buf = self._shm.buf
+		self._locks = [mp.RLock() for _ in range(stripes)]
+
+	def lock(self, key: str):
+		''' returns: The lock for the stripe holding `key`. Hold it across a read-modify-write.
+		'''
+		return self._locks[zlib.crc32(key.encode()) % self.stripes]
+
+	def limit(self, rate_limiter: Callable, key: str, **limiter_args) -> dict:
+		''' Runs `rate_limiter` for `key` atomically against this cache. Limiters that take a `clock` get this cache's clock, unless `limiter_args` has one.
+
+		`rate_limiter`: `fixed_window`, `enforced_avg` or `leaky_bucket`.
+
+		`limiter_args`: Keyword arguments for the rate limiter, e.g. `limit`, `window_length_ms`.
+
+		returns: The rate limiter result.
+		'''
+		if 'clock' not in limiter_args and _takes_clock(rate_limiter):
+			limiter_args['clock'] = self.clock
+		with self.lock(key):
+			return rate_limiter(key, cache=self, **limiter_args)
+
+	def _probe(self, key_bytes: bytes) -> tuple[int, int]:
+		''' returns: `(base, home)`: the first slot of the key's stripe, and where in the stripe its probe starts.
+		'''
+		h = zlib.crc32(key_bytes)
+		return h % self.stripes * self.stripe_size, (h // self.stripes) % self.stripe_size
+
+	def _find(self, key_bytes: bytes, now: float) -> tuple[int, int]:
+		''' Probes the stripe of `key_bytes`, deleting expired entries on the way.
+
+		returns: `(slot, free)`: the slot holding the live key or -1, and the empty slot ending its probe run or -1.
+		'''
+		base, home = self._probe(key_bytes)
+		deleted = False
+		i = 0
+
+		while i < self.stripe_size:
+			slot = base + (home + i) % self.stripe_size
+			state, _, key_len, _, _, _, expiration, stored_key = _SLOT.unpack_from(self._buf, slot * SLOT_SIZE)
+
+			if state == _EMPTY:  # end of the probe run
+				return -1, (self._first_empty(base, home) if deleted else slot)
+
+			if expiration <= now:
+				self._delete(base, slot - base)
+				deleted = True
+				continue  # a later entry may have moved into this slot
+
+			if key_len == len(key_bytes) and stored_key[:key_len] == key_bytes:
+				return slot, -1
+			i += 1
+
+		return -1, self._first_empty(base, home)
+
+	def _first_empty(self, base: int, home: int) -> int:
+		''' returns: The first empty slot from `home` on, or -1. Deleting can wrap around the stripe and empty a slot the probe already passed, so `_find()` looks again after a deletion.
+		'''
+		for i in range(self.stripe_size):
+			slot = base + (home + i) % self.stripe_size
+			if self._buf[slot * SLOT_SIZE] == _EMPTY:
+				return slot
+		return -1
+
+	def _delete(self, base: int, hole: int):
+		''' Empties the slot at `hole` within the stripe starting at `base`, moving back every later entry of its probe run that may go there. Caller holds the stripe lock.
+		'''
+		buf = self._buf
+		size = self.stripe_size
+		j = hole
+		for _ in range(size - 1):
+			j = (j + 1) % size
+			offset = (base + j) * SLOT_SIZE
+			if buf[offset] == _EMPTY:
+				break
+			home = _HOME.unpack_from(buf, offset + 4)[0]
+			if (j - home) % size >= (j - hole) % size:  # `hole` lies between the entry's home and its slot
+				hole_offset = (base + hole) * SLOT_SIZE
+				buf[hole_offset:hole_offset + SLOT_SIZE] = buf[offset:offset + SLOT_SIZE]
+				hole = j
+		buf[(base + hole) * SLOT_SIZE] = _EMPTY
+
+	@staticmethod
+	def _encode_key(key: str) -> bytes:
+		key_bytes = key.encode()
+		if len(key_bytes) > MAX_KEY_BYTES:
+			raise ValueError(f'Key too long for shared memory slot ({len(key_bytes)} > {MAX_KEY_BYTES} bytes): {key}')
+		return key_bytes
+
+	def set(self, key, value, ttl = None):
+		''' Sets data with optional TTL in milliseconds.
+
+        `key`: The key to set.
+
+        `value`: An `int`, or a `leaky_bucket` entry `{'counter': ..., 'time': ...}`.
+
+        `ttl`: The time-to-live in milliseconds.
+        '''
+		if isinstance(value, dict):
+			kind, a, b = _KIND_BUCKET, value['counter'], value['time']
+		elif isinstance(value, int):
+			kind, a, b = _KIND_INT, value, 0.0
+		else:
+			raise TypeError(f'SharedMemoryCache cannot store {type(value).__name__} values')
+
+		key_bytes = self._encode_key(key)
+
+		with self.lock(key):
+			now = self.clock.now()
+			expiration = now + ttl if ttl else _NO_EXPIRATION
+			slot, free = self._find(key_bytes, now)
+			if slot == -1:
+				slot = free
+			if slot == -1:
+				raise MemoryError(f'SharedMemoryCache stripe is full ({self.stripe_size} slots); increase capacity')
+
+			_SLOT.pack_into(self._buf, slot * SLOT_SIZE, _USED, kind, len(key_bytes), self._probe(key_bytes)[1], a, b, expiration, key_bytes)
+
+	def get(self, key: str) -> Any:
+		''' Gets data if it exists and TTL has not expired.
+
+        `key`: The key to get.
+
+        returns: The value associated with the key, or None if the key does not exist or has expired.
+        '''
+		key_bytes = self._encode_key(key)
+
+		with self.lock(key):
+			slot, _ = self._find(key_bytes, self.clock.now())
+			if slot == -1:
+				return None
+			_, kind, _, _, a, b, _, _ = _SLOT.unpack_from(self._buf, slot * SLOT_SIZE)
+
+		if kind == _KIND_BUCKET:
+			return {'counter': a, 'time': b}
+		return int(a)
+
+	def incr(self, key):
+		''' Increments the value of a key. Does not reset TTL. Does nothing if the key has expired since the caller's `get()`, which a real clock can cross at the end of a window; the entry is gone either way, just like in `DummyCache`.
+
+        `key`: The key to increment.
+        '''
+		key_bytes = self._encode_key(key)
+
+		with self.lock(key):
+			slot, _ = self._find(key_bytes, self.clock.now())
+			if slot == -1:
+				return
+			offset = slot * SLOT_SIZE
+			state, kind, key_len, home, a, b, expiration, stored_key = _SLOT.unpack_from(self._buf, offset)
+			if kind == _KIND_INT:
+				_SLOT.pack_into(self._buf, offset, state, kind, key_len, home, a + 1, b, expiration, stored_key)
+
+	def __len__(self):
+		''' Number of occupied slots, including expired ones that haven't been probed past yet. Scans the whole table.
+		'''
+		return sum(self._buf[slot * SLOT_SIZE] == _USED for slot in range(self.capacity))
+
+	def reset(self):
+		''' Resets the data store.
+        '''
+		for lock in self._locks:
+			lock.acquire()
+		try:
+			self._buf[:] = bytes(len(self._buf))
+		finally:
+			for lock in self._locks:
+				lock.release()
+
+	def close(self):
+		''' Detaches this process from the shared memory.
+		'''
+		self._buf.release()
+		self._shm.close()
+
+	def unlink(self):
+		''' Frees the shared memory. Call once, from the process that created the cache.
+		'''
+		self._shm.unlink()
+
+if __name__ == "__main__":
+	import multiprocessing as mp
+	# every forked worker shares the same limit
+	from rate_limiters import fixed_window, leaky_bucket
+
+	WORKERS = 4
+	REQUESTS = 2000
+	LIMIT = 100
+
+	cache = SharedMemoryCache(capacity=1024)
+	results = mp.get_context('fork').Queue()
+
+	def worker(rate_limiter, limiter_args):
+		oks = sum(cache.limit(rate_limiter, 'global', **limiter_args)['status'] == 'OK' for _ in range(REQUESTS))
+		results.put(oks)
+
+	for rate_limiter, limiter_args in [
+		(fixed_window, {'limit': LIMIT, 'window_length_ms': 60_000}),
+		(leaky_bucket, {'limit': LIMIT, 'window_length_ms': 60_000, 'mode': 'soft'}),
+	]:
+		cache.reset()
+		procs = [mp.get_context('fork').Process(target=worker, args=(rate_limiter, limiter_args)) for _ in range(WORKERS)]
+		for proc in procs:
+			proc.start()
+		oks = sum(results.get() for _ in procs)
+		for proc in procs:
+			proc.join()
+		print(f'{rate_limiter.__name__:>14}: {oks} OK from {WORKERS} workers x {REQUESTS} requests (limit {LIMIT})')
+
+	cache.close()
+	cache.unlink()
+
+	# churn: IP-like keys that come and go, 1k new keys every 100 ms with a 1 s window, so ~10k are live at a time
+	import time
+	from clocks import ManualClock
+
+	clock = ManualClock(0.0)
+	cache = SharedMemoryCache(capacity=65536, clock=clock)
+
+	def churn(step: int) -> float:
+		clock.set(step * 100.0)
+		start = time.perf_counter()
+		for i in range(step * 1000, (step + 1) * 1000):
+			cache.limit(fixed_window, f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}', limit=5, window_length_ms=1000)
+		return (time.perf_counter() - start) / 1000 * 1e6
+
+	fresh_us = churn(0)
+	for step in range(1, 200):
+		churned_us = churn(step)
+	print(f'         churn: {fresh_us:.1f} us / limit() on a fresh table, {churned_us:.1f} us after 200k distinct keys')
+
+	cache.close()
+	cache.unlink()
@@ -0,0 +1,243 @@
+'''Snapshot and warm restart for `DummyCache` limiter state.
+
+When the limiter process restarts with an empty cache, every client gets a fresh quota at the same moment. `save()` writes the live entries to a compact binary file, and `load()` puts them back after the restart.
+
+Times are rebased onto the new process's clock, because clocks like `MonotonicClock` don't carry over between processes (or reboots). Each TTL, each `leaky_bucket` and shaped-limiter time and each `sliding_window` timestamp is stored relative to the clock at save time, and restored relative to the clock at load time. The downtime in between (by default, measured on the wall clock) is taken off, so buckets keep leaking and windows keep expiring across the restart. Entries that expired during the downtime aren't restored.
+
+Supports the values the limiters store: `int` (`fixed_window`, `enforced_avg`), `float` (taken to be an absolute time and rebased like the other times), `leaky_bucket` and shaped-limiter entries (`{'counter': ..., 'time': ...}`) and `sliding_window` lists.
+
+Format: a header, then chunks of up to `chunk_size` entries, then an empty chunk as end marker. Each chunk is columnar: kinds, TTLs, values, key lengths and list lengths as packed arrays, then the UTF-8 keys, then the `sliding_window` timestamps. `save()` writes chunk by chunk to a temporary file and renames it into place, so a crash mid-save leaves the previous snapshot intact. `load()` memory-maps the file and converts each column with a single `array.frombytes()`. Run `python snapshot.py` to time a million keys.
+'''
+
+import os
+import sys
+import mmap
+import math
+import time
+import struct
+from array import array
+from itertools import accumulate
+
+_MAGIC = b'RLSNAP\x00\x01'
+_HEADER = struct.Struct('<8sdd')  # magic, clock time at save, wall time at save
+_CHUNK = struct.Struct('<III')  # entries, key bytes, list values
+
+_KIND_INT = 0  # `fixed_window` counter, `enforced_avg` flag; value in `a`
+_KIND_BUCKET = 1  # `leaky_bucket` / shaped entry; `a` is the counter, `b` is the relative time
+_KIND_LIST = 2  # `sliding_window` times, relative, in the chunk's list values
+_KIND_TIME = 3  # bare absolute time; `a` is the relative time
+
+_BYTE_ORDER_OK = sys.byteorder == 'little'  # arrays are written in native order; the format is little-endian
+
+def _to_bytes(values: array) -> bytes:
+	if not _BYTE_ORDER_OK:
+		values = array(values.typecode, values)
+		values.byteswap()
+	return values.tobytes()
+
+def _from_bytes(typecode: str, data) -> array:
+	values = array(typecode)
+	values.frombytes(data)
+	if not _BYTE_ORDER_OK:
+		values.byteswap()
+	return values
+
+def save(cache, path: str, chunk_size: int = 65536) -> int:
+	''' Writes the live entries of `cache` to `path`.
+
+	`cache`: A `DummyCache`.
+
+	`path`: Destination file. Replaced atomically; on failure, the previous file is left as it was and no temporary file is left behind.
+
+	`chunk_size`: Entries per chunk, which bounds the column buffers. The only other extra memory is a snapshot of the keys (one reference per key) taken up front, so entries added while saving aren't included.
+
+	returns: The number of entries written.
+	'''
+	now = cache.now()
+	tmp_path = f'{path}.tmp'
+	written = 0
+
+	try:
+		with open(tmp_path, 'wb') as file:
+			file.write(_HEADER.pack(_MAGIC, now, time.time()))
+			data = cache.data
+			keys_left = iter(tuple(data))
+
+			while True:
+				kinds, ttls, a, b = array('B'), array('d'), array('d'), array('d')
+				key_lengths, list_lengths, list_values = array('I'), array('I'), array('d')
+				keys = []
+
+				for key in keys_left:
+					entry = data.get(key)
+					if entry is None:  # deleted since the snapshot of the keys
+						continue
+					expiration = entry['expiration']
+					if expiration is not None and expiration <= now:  # already expired
+						continue
+					value = entry['value']
+
+					if isinstance(value, dict):
+						kinds.append(_KIND_BUCKET)
+						a.append(value['counter'])
+						b.append(value['time'] - now)
+						list_lengths.append(0)
+					elif isinstance(value, list):
+						kinds.append(_KIND_LIST)
+						a.append(0.0)
+						b.append(0.0)
+						list_lengths.append(len(value))
+						list_values.extend([time_ms - now for time_ms in value])
+					elif isinstance(value, float):
+						kinds.append(_KIND_TIME)
+						a.append(value - now)
+						b.append(0.0)
+						list_lengths.append(0)
+					elif isinstance(value, int):
+						kinds.append(_KIND_INT)
+						a.append(value)
+						b.append(0.0)
+						list_lengths.append(0)
+					else:
+						raise TypeError(f'Cannot snapshot {type(value).__name__} values (key {key!r})')
+
+					ttls.append(math.inf if expiration is None else expiration - now)
+					key_bytes = key.encode()
+					keys.append(key_bytes)
+					key_lengths.append(len(key_bytes))
+					if len(kinds) == chunk_size:
+						break
+
+				key_blob = b''.join(keys)
+				file.write(_CHUNK.pack(len(kinds), len(key_blob), len(list_values)))
+				if not kinds:  # end marker
+					break
+				for column in (kinds, ttls, a, b, key_lengths, list_lengths):
+					file.write(_to_bytes(column))
+				file.write(key_blob)
+				file.write(_to_bytes(list_values))
+				written += len(kinds)
+
+			file.flush()
+			os.fsync(file.fileno())
+		os.replace(tmp_path, path)
+	except BaseException:  # don't leave a partial file behind
+		try:
+			os.remove(tmp_path)
+		except FileNotFoundError:
+			pass
+		raise
+
+	return written
+
+def load(cache, path: str, downtime_ms: float = None) -> int:
+	''' Restores a snapshot into `cache`, rebasing times onto its clock. Existing entries with the same keys are overwritten.
+
+	`cache`: A `DummyCache`.
+
+	`downtime_ms`: Time that passed since the snapshot, taken off every TTL. Defaults to the wall-clock time since `save()`; pass `0` to resume as if no time had passed.
+
+	returns: The number of entries restored.
+	'''
+	with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+		magic, _, saved_wall = _HEADER.unpack_from(buffer, 0)
+		if magic != _MAGIC:
+			raise ValueError(f'Not a rate limiter snapshot: {path}')
+		if downtime_ms is None:
+			downtime_ms = max(time.time() - saved_wall, 0) * 1000
+
+		base = cache.now() - downtime_ms  # the saved clock's "now", on the new clock
+		data = cache.data
+		view = memoryview(buffer)
+		offset = _HEADER.size
+		restored = 0
+
+		try:
+			while True:
+				count, key_bytes, num_list_values = _CHUNK.unpack_from(buffer, offset)
+				offset += _CHUNK.size
+				if not count:
+					break
+
+				columns = []
+				for typecode, size in (('B', 1), ('d', 8), ('d', 8), ('d', 8), ('I', 4), ('I', 4)):
+					columns.append(_from_bytes(typecode, view[offset:offset + count * size]))
+					offset += count * size
+				kinds, ttls, a, b, key_lengths, list_lengths = columns
+
+				key_blob = bytes(view[offset:offset + key_bytes])
+				keys_text = key_blob.decode()
+				if len(keys_text) == key_bytes:  # all ASCII (e.g. IPs): byte offsets are character offsets, so slice the decoded text
+					key_blob = keys_text
+				offset += key_bytes
+				list_values = _from_bytes('d', view[offset:offset + 8 * num_list_values])
+				offset += 8 * num_list_values
+
+				key_ends = list(accumulate(key_lengths))
+				list_start = 0
+				for i, key_end in enumerate(key_ends):
+					ttl = ttls[i] - downtime_ms
+					kind = kinds[i]
+					if kind == _KIND_LIST:
+						list_end = list_start + list_lengths[i]
+						times = list_values[list_start:list_end]
+						list_start = list_end
+					if ttl <= 0:  # expired during the downtime
+						continue
+
+					if kind == _KIND_INT:
+						value = int(a[i])
+					elif kind == _KIND_BUCKET:
+						value = {'counter': a[i], 'time': base + b[i]}
+					elif kind == _KIND_TIME:
+						value = base + a[i]
+					else:
+						value = [base + time_ms for time_ms in times]
+
+					key = key_blob[key_end - key_lengths[i]:key_end]
+					if key.__class__ is bytes:
+						key = key.decode()
+					data[key] = {"value": value, "expiration": None if ttl == math.inf else base + downtime_ms + ttl}
+					restored += 1
+		finally:
+			view.release()
+
+	return restored
+
+if __name__ == "__main__":
+	import tempfile
+	from clocks import ManualClock
+	from dummy_cache import DummyCache
+	from rate_limiters import fixed_window, sliding_window, leaky_bucket
+
+	NUM_KEYS = 1_000_000
+
+	clock = ManualClock(5_000.0)
+	cache = DummyCache(clock=clock)
+	for i in range(NUM_KEYS):
+		key = f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'
+		if i % 4 == 0:
+			sliding_window(key, 5, 1000, clock=clock, cache=cache)
+		elif i % 4 == 1:
+			fixed_window(key, 5, 1000, cache=cache)
+		else:
+			leaky_bucket(key, 5, 1000, 'soft', clock=clock, cache=cache)
+
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, 'limiter.snap')
+
+		start = time.perf_counter()
+		written = save(cache, path)
+		save_s = time.perf_counter() - start
+		print(f'save: {written:,} keys in {save_s:.2f} s, {os.path.getsize(path) / 1e6:.1f} MB ({os.path.getsize(path) / written:.0f} B / key)')
+
+		# "restart": a new cache on a clock that starts over, 100 ms after the snapshot
+		restarted = DummyCache(clock=ManualClock(0.0))
+		start = time.perf_counter()
+		restored = load(restarted, path, downtime_ms=100)
+		load_s = time.perf_counter() - start
+		print(f'load: {restored:,} keys in {load_s:.2f} s')
+
+	key = '10.0.0.2'  # a leaky bucket key
+	print(f'{key} before: {cache.data[key]}')
+	print(f'{key} after:  {restarted.data[key]}  (times rebased from t = 5000 to t = 0, minus 100 ms downtime)')